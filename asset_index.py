@@ -0,0 +1,153 @@
+# asset_index.py
+#
+# Local sqlite index of runZero assets shared by the tag, delete and export scripts.
+#
+# The index is filled by sync_asset_index.py and holds the id, addresses, macs, names, type, site and
+# tags of every asset in every organization, indexed by address, mac and id. It also stores the ids of
+# assets matching the queries listed in sync_asset_index.INDEX_QUERIES so scripts that select assets
+# with a search query can look them up locally. Scripts run with --from-index answer their lookups
+# from the index and only call the API for changes such as tagging or deleting assets.
+
+import json
+import os
+import sqlite3
+import time
+
+# default path of the index shared by all scripts; set RUNZERO_ASSET_INDEX in .env to move it
+INDEX_DB = 'asset_index.db'
+
+# attributes fetched from /org/assets and stored for every asset
+INDEX_FIELDS = 'id,addresses,macs,names,type,site_id,tags'
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS orgs (id TEXT PRIMARY KEY, name TEXT NOT NULL)',
+    '''CREATE TABLE IF NOT EXISTS assets (
+        id TEXT PRIMARY KEY,
+        org_id TEXT NOT NULL,
+        site_id TEXT,
+        type TEXT,
+        names TEXT,
+        tags TEXT,
+        addresses TEXT,
+        macs TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS assets_org ON assets (org_id)',
+    'CREATE TABLE IF NOT EXISTS asset_addresses (address TEXT NOT NULL, org_id TEXT NOT NULL, asset_id TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS asset_addresses_address ON asset_addresses (address, org_id)',
+    'CREATE TABLE IF NOT EXISTS asset_macs (mac TEXT NOT NULL, org_id TEXT NOT NULL, asset_id TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS asset_macs_mac ON asset_macs (mac, org_id)',
+    'CREATE TABLE IF NOT EXISTS query_matches (query TEXT NOT NULL, org_id TEXT NOT NULL, asset_id TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS query_matches_query ON query_matches (query, org_id)',
+    'CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+]
+
+ASSET_COLUMNS = 'id, org_id, site_id, type, names, tags, addresses, macs'
+
+# maximum number of bound parameters used in a single IN (...) lookup
+LOOKUP_CHUNK_SIZE = 500
+
+# return the path of the shared index
+def index_path():
+    return os.getenv('RUNZERO_ASSET_INDEX', INDEX_DB)
+
+# open the asset index, creating the tables if needed
+def open_index(path=None):
+    db = sqlite3.connect(path or index_path())
+    db.execute('PRAGMA journal_mode=WAL')
+    for statement in SCHEMA:
+        db.execute(statement)
+    return db
+
+# replace all assets stored for an organization
+def replace_org_assets(db, org_id, org_name, assets):
+    db.execute('INSERT OR REPLACE INTO orgs (id, name) VALUES (?, ?)', (org_id, org_name))
+    db.execute('DELETE FROM assets WHERE org_id = ?', (org_id,))
+    db.execute('DELETE FROM asset_addresses WHERE org_id = ?', (org_id,))
+    db.execute('DELETE FROM asset_macs WHERE org_id = ?', (org_id,))
+    count = 0
+    for a in assets:
+        asset_id = a.get('id', '')
+        addresses = a.get('addresses') or []
+        macs = [m.lower() for m in a.get('macs') or []]
+        db.execute(
+            'INSERT OR REPLACE INTO assets (id, org_id, site_id, type, names, tags, addresses, macs) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (asset_id, org_id, a.get('site_id', ''), a.get('type', ''), json.dumps(a.get('names') or []),
+             json.dumps(a.get('tags') or {}), json.dumps(addresses), json.dumps(macs))
+        )
+        db.executemany('INSERT INTO asset_addresses (address, org_id, asset_id) VALUES (?, ?, ?)', [(addr, org_id, asset_id) for addr in addresses])
+        db.executemany('INSERT INTO asset_macs (mac, org_id, asset_id) VALUES (?, ?, ?)', [(m, org_id, asset_id) for m in macs])
+        count += 1
+    return count
+
+# remove all stored query matches ahead of a full sync
+def clear_query_matches(db):
+    db.execute('DELETE FROM query_matches')
+    db.execute("DELETE FROM state WHERE key LIKE 'query:%'")
+
+# replace the ids of assets matching a query within an organization
+def replace_query_matches(db, query, org_id, asset_ids):
+    db.execute('DELETE FROM query_matches WHERE query = ? AND org_id = ?', (query, org_id))
+    db.executemany('INSERT INTO query_matches (query, org_id, asset_id) VALUES (?, ?, ?)', [(query, org_id, i) for i in asset_ids])
+
+    # mark the query as indexed so an empty match list is not mistaken for a missing query
+    db.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', ('query:' + org_id + ':' + query, str(time.time())))
+
+# record the time of the last completed sync
+def mark_synced(db):
+    db.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', ('synced_at', str(time.time())))
+
+# return the age of the index in seconds, or None if it has never been synced
+def index_age(db):
+    row = db.execute('SELECT value FROM state WHERE key = ?', ('synced_at',)).fetchone()
+    return time.time() - float(row[0]) if row else None
+
+def asset_from_row(row):
+    return {
+        'id': row[0],
+        'org_id': row[1],
+        'site_id': row[2],
+        'type': row[3],
+        'names': json.loads(row[4]),
+        'tags': json.loads(row[5]),
+        'addresses': json.loads(row[6]),
+        'macs': json.loads(row[7])
+    }
+
+# return organizations in the index in the same shape as /account/orgs
+def get_organizations(db):
+    return [{'id': r[0], 'name': r[1]} for r in db.execute('SELECT id, name FROM orgs ORDER BY name')]
+
+# return all assets stored for an organization
+def get_org_assets(db, org_id):
+    return [asset_from_row(r) for r in db.execute(f'SELECT {ASSET_COLUMNS} FROM assets WHERE org_id = ?', (org_id,))]
+
+# look up assets by id
+def get_assets_by_id(db, asset_ids):
+    return lookup(db, f'SELECT {ASSET_COLUMNS} FROM assets WHERE id IN ({{}})', list(asset_ids))
+
+# look up assets within an organization that have any of the given addresses
+def get_assets_by_address(db, org_id, addresses):
+    return lookup(db, f'SELECT {ASSET_COLUMNS} FROM assets WHERE id IN (SELECT asset_id FROM asset_addresses WHERE org_id = ? AND address IN ({{}}))', list(addresses), (org_id,))
+
+# look up assets within an organization that have any of the given macs
+def get_assets_by_mac(db, org_id, macs):
+    return lookup(db, f'SELECT {ASSET_COLUMNS} FROM assets WHERE id IN (SELECT asset_id FROM asset_macs WHERE org_id = ? AND mac IN ({{}}))', [m.lower() for m in macs], (org_id,))
+
+# return the ids of assets matching a query that was indexed by the sync job, or None if the query
+# is not indexed for the organization
+def get_query_matches(db, query, org_id):
+    indexed = db.execute('SELECT value FROM state WHERE key = ?', ('query:' + org_id + ':' + query,)).fetchone()
+    if not indexed:
+        return None
+    return [r[0] for r in db.execute('SELECT asset_id FROM query_matches WHERE query = ? AND org_id = ?', (query, org_id))]
+
+# run an IN (...) lookup in chunks and return the matching assets
+# an asset matched by values in more than one chunk is only returned once
+def lookup(db, statement, values, params=()):
+    assets = {}
+    for i in range(0, len(values), LOOKUP_CHUNK_SIZE):
+        chunk = values[i:i + LOOKUP_CHUNK_SIZE]
+        sql = statement.format(', '.join('?' * len(chunk)))
+        for r in db.execute(sql, tuple(params) + tuple(chunk)):
+            assets[r[0]] = asset_from_row(r)
+    return list(assets.values())
@@ -0,0 +1,151 @@
+# bench_export_assets.py
+#
+# Measures rows/sec for the attribute parsing and csv writing stages of export_assets_to_csv.py on a synthetic export.
+# The "before" numbers come from a copy of the original per-column parser kept below for comparison.
+#
+# Usage:
+#     python3 benchmarks/bench_export_assets.py [asset_count]
+
+import csv
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import export_assets_to_csv
+import runzero_export
+
+ASSET_COUNT = 500000
+
+# number of distinct synthetic assets; the export cycles through these to reach ASSET_COUNT
+DISTINCT_ASSETS = 1000
+
+# Build a synthetic asset resembling an /export/org/assets.json record with crowdstrike and intune data
+def synthetic_asset(rng, i):
+    asset = {
+        'id': '%08x-0000-4000-8000-%012x' % (i, i),
+        'addresses': ['10.%d.%d.%d' % (rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(rng.randrange(1, 4))],
+        'macs': ['00:11:22:%02x:%02x:%02x' % (rng.randrange(256), rng.randrange(256), rng.randrange(256))],
+        'mac_vendors': ['Dell Inc.'],
+        'names': ['DESKTOP-%05d' % i, 'desktop-%05d.corp.example.com' % i],
+        'type': rng.choice(['Desktop', 'Laptop']),
+        'tags': {'owner': 'it', 'env': 'prod'},
+        'os_vendor': 'Microsoft',
+        'os_product': 'Windows 11',
+        'os_version': '23H2',
+        'hw_vendor': 'Dell',
+        'hw_product': 'Latitude 7440',
+        'hw_version': '',
+        'foreign_attributes': {}
+    }
+    crowdstrike = []
+    for d in range(rng.randrange(1, 4)):
+        crowdstrike.append({
+            'ts': str(1700000000 + rng.randrange(10000000)),
+            'hostname': 'DESKTOP-%05d' % i,
+            'siteName': 'HQ',
+            'lastLoginTS': '2024-11-01T10:00:00Z',
+            'lastLoginUser': 'user%d' % i,
+            'lastSeen': '2024-11-30T10:00:00Z',
+            'lastReboot': '2024-11-29T10:00:00Z',
+            'systemManufacturer': 'Dell Inc.',
+            'systemProductName': 'Latitude 7440',
+            'biosManufacturer': 'Dell Inc.',
+            'biosVersion': '1.2.3',
+            'discover.cpuProcessorName': 'Intel(R) Core(TM) i7',
+            'discover.systemSerialNumber': 'SN%06d' % i,
+            'discover.city': 'Boston',
+            'discover.country': 'United States'
+        })
+    asset['foreign_attributes']['@crowdstrike.dev'] = crowdstrike
+    if rng.random() < 0.7:
+        asset['foreign_attributes']['@intune.dev'] = [{
+            'ts': str(1700000000 + rng.randrange(10000000)),
+            'deviceName': 'DESKTOP-%05d' % i,
+            'serialNumber': 'SN%06d' % i,
+            'manufacturer': 'Dell Inc.',
+            'model': 'Latitude 7440',
+            'userDisplayName': 'User %d' % i,
+            'userID': 'uid-%d' % i,
+            'userPrincipalName': 'user%d@example.com' % i
+        }]
+    return asset
+
+# Original per-column parser from export_assets_to_csv.py, kept as the baseline
+def baseline_parse_asset(asset):
+    record = {}
+    for a in export_assets_to_csv.ASSET_ATTRIBUTES:
+        if a == 'names' or a == 'addresses' or a == 'macs' or a == 'mac_vendors' or a == 'tags':
+            attrib = json.dumps(asset.get(a,''))
+            attrib = attrib.replace('[','').replace(']','').replace('{','').replace('}','').replace('"','')
+            record[a] = attrib
+        elif a.startswith('@'):
+            split_a = a.split('.',2)
+            foreign_attribute_source = split_a[0] + '.' + split_a[1]
+            foreign_attribute = split_a[2]
+            foreign_asset_records = asset.get('foreign_attributes', {}).get(foreign_attribute_source, [])
+            if foreign_asset_records:
+                if len(foreign_asset_records) > 1:
+                    most_recent_foreign_asset = foreign_asset_records[0]
+                    for f in foreign_asset_records:
+                        timestamp = int(f.get('ts', '0'))
+                        most_recent_timestamp = int(most_recent_foreign_asset.get('ts', '0'))
+                        if timestamp > most_recent_timestamp:
+                            most_recent_foreign_asset = f
+                        record[a] = most_recent_foreign_asset.get(foreign_attribute, '')
+                else:
+                    record[a] = foreign_asset_records[0].get(foreign_attribute, '')
+        else:
+            record[a] = asset.get(a, '')
+    return record
+
+class NullWriter:
+    def write(self, s):
+        return len(s)
+
+# Write baseline rows to a discarded csv stream the way the original script did
+class BaselineCsvWriter:
+    def __init__(self):
+        self.writer = csv.DictWriter(NullWriter(), fieldnames=export_assets_to_csv.ASSET_ATTRIBUTES)
+
+    def write(self, record):
+        self.writer.writerow(record)
+
+    def close(self):
+        pass
+
+# Parse and write asset_count rows and return rows/sec
+def run(label, parse, writer, assets, asset_count):
+    start = time.perf_counter()
+    for i in range(asset_count):
+        writer.write(parse(assets[i % len(assets)]))
+    writer.close()
+    elapsed = time.perf_counter() - start
+    rate = asset_count / elapsed
+    print(f'{label:<10} {asset_count} rows in {elapsed:6.2f}s  {rate:10.0f} rows/sec')
+    return rate
+
+def main():
+    asset_count = int(sys.argv[1]) if len(sys.argv) > 1 else ASSET_COUNT
+    rng = random.Random(1)
+    assets = [synthetic_asset(rng, i) for i in range(DISTINCT_ASSETS)]
+
+    # both parsers must produce identical rows for the original columns
+    plan = export_assets_to_csv.compile_attribute_plan(export_assets_to_csv.ASSET_ATTRIBUTES, export_assets_to_csv.COALESCED_ATTRIBUTES)
+    for asset in assets:
+        row = export_assets_to_csv.parse_asset(asset, plan)
+        for a in plan['list']:
+            row[a] = runzero_export.flatten_value(row[a])
+        if baseline_parse_asset(asset) != {a: row[a] for a in row if a not in export_assets_to_csv.COALESCED_ATTRIBUTES}:
+            print('Compiled plan output differs from baseline for asset ' + asset['id'])
+            exit(1)
+
+    before = run('before', baseline_parse_asset, BaselineCsvWriter(), assets, asset_count)
+    writer = runzero_export.open_writer(os.devnull, 'csv', plan['columns'], plan['list'])
+    after = run('after', lambda asset: export_assets_to_csv.parse_asset(asset, plan), writer, assets, asset_count)
+    print(f'speedup    {after / before:.2f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# bench_scope_normalizer.py
+#
+# Measures ip_ranges.normalize_scope on synthetic site scope entries (addresses, CIDRs, ranges, comma separated
+# lists, hostnames and IPv6) and compares it with parsing every token with ip_ranges.parse_scope_token, which
+# is what the scripts did before. Both must produce the same ranges.
+#
+# Usage:
+#     python3 benchmarks/bench_scope_normalizer.py [entry_count]
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ip_ranges import normalize_scope, parse_scope_token
+
+ENTRY_COUNT = 500000
+
+def synthetic_entries(rng, count):
+    def ip():
+        return '%d.%d.%d.%d' % (rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.randrange(256))
+
+    entries = []
+    for i in range(count):
+        roll = rng.random()
+        if roll < 0.4:
+            entries.append(ip())
+        elif roll < 0.7:
+            entries.append('%s/%d' % (ip(), rng.randrange(16, 33)))
+        elif roll < 0.8:
+            start = rng.randrange(1 << 32)
+            end = min(start + rng.randrange(1 << 12), (1 << 32) - 1)
+            entries.append('-'.join('%d.%d.%d.%d' % tuple(v.to_bytes(4, 'big')) for v in (start, end)))
+        elif roll < 0.95:
+            entries.append(ip() + ', ' + ip())
+        elif roll < 0.98:
+            entries.append('host%d.example.com' % i)
+        elif roll < 0.99:
+            entries.append('2001:db8::%x:%x/%d' % (i >> 16, i & 0xffff, rng.randrange(64, 129)))
+        else:
+            entries.append('10.0.%d.1-%d' % (i % 256, rng.randrange(1, 256)))
+    return entries
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else ENTRY_COUNT
+    entries = synthetic_entries(random.Random(1), count)
+
+    start = time.perf_counter()
+    expected = []
+    for i, entry in enumerate(entries):
+        for token in entry.replace(',', ' ').split():
+            parsed = parse_scope_token(token)
+            if parsed is not None:
+                expected.append((i,) + parsed)
+    baseline_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = normalize_scope(entries)
+    seconds = time.perf_counter() - start
+
+    if sorted(expected) != sorted(zip(table.range_sources(), *zip(*table.ranges()))):
+        print('normalize_scope output differs from per-token parsing')
+        exit(1)
+    print(f'{count} entries, {len(table)} ranges, {len(table.hostnames)} hostnames, {len(table.invalid)} invalid')
+    print(f'per-token parsing {baseline_seconds:6.2f}s')
+    print(f'normalize_scope   {seconds:6.2f}s  ({count / seconds:,.0f} entries/s)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# bench_subnet_overlaps.py
+#
+# Measures get_overlapping_registered_subnets.find_overlaps on synthetic registered subnets at 10k, 100k and 1M
+# subnets. The "before" number comes from a copy of the original pairwise comparison, which is only run on
+# BASELINE_SUBNETS subnets because it grows with the square of the subnet count; its time at the larger sizes
+# is extrapolated from that run.
+#
+# Usage:
+#     python3 benchmarks/bench_subnet_overlaps.py [subnet_count ...]
+
+import ipaddress
+import os
+import random
+import sys
+import time
+from itertools import combinations
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import get_overlapping_registered_subnets
+
+SUBNET_COUNTS = [10000, 100000, 1000000]
+BASELINE_SUBNETS = 2000
+SITES = 1000
+
+# original O(n^2) implementation kept for comparison
+def baseline_find_overlaps(subnet_list):
+    subnet_list = [(ipaddress.ip_network(s[0]),) + s[1:] for s in subnet_list]
+    overlaps = []
+    for (net1, sid1, name1, _, _), (net2, sid2, name2, _, _) in combinations(subnet_list, 2):
+        if sid1 != sid2 and net1.overlaps(net2):
+            overlaps.append({'site1_id': sid1, 'site1_name': name1, 'subnet1': str(net1), 'site2_id': sid2, 'site2_name': name2, 'subnet2': str(net2)})
+    return overlaps
+
+# mostly /24 and smaller subnets spread over the IPv4 space, some IPv6 /64s and a few /16 summaries in
+# 10.0.0.0/8 that contain other sites' subnets, assigned to SITES sites
+def synthetic_subnets(rng, count):
+    subnets = []
+    for i in range(count):
+        site = i % SITES
+        roll = rng.random()
+        if roll < 0.001:
+            net = ipaddress.IPv4Network((0x0a000000 | rng.randrange(256) << 16, 16))
+        elif roll < 0.05:
+            net = ipaddress.IPv6Network((0x20010db8 << 96 | rng.randrange(1 << 20) << 64, 64))
+        elif roll < 0.10:
+            net = ipaddress.IPv4Network((0x0a000000 | rng.randrange(1 << 16) << 8, 24))
+        else:
+            prefix = rng.choice([24, 24, 24, 25, 26, 27, 28])
+            net = ipaddress.IPv4Network((rng.randrange(1 << 32) >> (32 - prefix) << (32 - prefix), prefix))
+        subnets.append((str(net), 'site-%d' % site, 'Site %d' % site, '', ''))
+    return subnets
+
+def main():
+    counts = [int(c) for c in sys.argv[1:]] or SUBNET_COUNTS
+    rng = random.Random(1)
+
+    # both implementations must find the same pairs
+    sample = synthetic_subnets(rng, BASELINE_SUBNETS)
+    start = time.perf_counter()
+    before = baseline_find_overlaps(sample)
+    baseline_seconds = time.perf_counter() - start
+    after = get_overlapping_registered_subnets.find_overlaps(sample)
+    pair = lambda o: frozenset([(o['site1_id'], o['subnet1']), (o['site2_id'], o['subnet2'])])
+    if sorted(map(sorted, map(pair, before))) != sorted(map(sorted, map(pair, after))):
+        print('Sweep output differs from baseline')
+        exit(1)
+    print(f'baseline   {BASELINE_SUBNETS:>8} subnets {baseline_seconds:8.2f}s  {len(before)} overlaps')
+
+    print(f'{"subnets":>8} {"sweep s":>9} {"overlaps":>10} {"contained":>10} {"baseline s (est.)":>18}')
+    for count in counts:
+        subnets = synthetic_subnets(rng, count)
+        start = time.perf_counter()
+        overlaps = get_overlapping_registered_subnets.find_overlaps(subnets)
+        seconds = time.perf_counter() - start
+        contained = sum(1 for o in overlaps if o['relationship'] == 'contains')
+        estimate = baseline_seconds * (count / BASELINE_SUBNETS) ** 2
+        print(f'{count:>8} {seconds:>9.2f} {len(overlaps):>10} {contained:>10} {estimate:>18.0f}')
+
+if __name__ == '__main__':
+    main()
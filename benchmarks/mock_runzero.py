@@ -0,0 +1,390 @@
+# mock_runzero.py
+#
+# Local stand-in for the runZero API used to test and benchmark the scripts in this repository without a
+# live console. Synthetic organizations, sites, assets, services, tasks and explorers are generated on the
+# fly from their index, so the server can present millions of assets without holding them in memory.
+#
+# Served endpoints (under /api/v1.0):
+#     POST  /account/api/token                 GET  /org/sites            GET  /export/org/assets.json
+#     GET   /account/orgs                      GET  /org/assets           GET  /export/org/services.json
+#     GET   /account/tasks                     GET  /org/tasks            GET  /export/org/sites.json
+#     GET   /account/tasks/templates           GET  /org/explorers        GET  /export/org/sites.csv
+#     PATCH /org/assets/{id}/tags              POST /org/assets/bulk/delete
+#     PATCH /org/sites/{id}                    PATCH /org/assets/bulk/tags
+#     GET   /org/sites/{id}
+#     GET   /__stats                           (request counters used by the benchmark runner)
+#
+# Only the fields= parameter and simple site:<id>, address:<ip or cidr> and asset id searches are interpreted;
+# any other search returns every asset in the organization. Site updates are kept in memory; other mutations
+# are acknowledged but not applied.
+#
+# Usage:
+#     python3 benchmarks/mock_runzero.py --assets 100000 --orgs 10 --latency-ms 20 --error-rate 0.01
+#
+# Then point RUNZERO_BASE_URL at http://127.0.0.1:8800/api/v1.0
+
+import argparse
+import ipaddress
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = '/api/v1.0'
+
+# number of records encoded into each chunk of a streamed response
+RECORDS_PER_CHUNK = 500
+
+class MockData:
+    def __init__(self, assets=10000, orgs=4, sites_per_org=5, explorers_per_org=2, tasks_per_org=20):
+        self.asset_count = assets
+        self.org_count = orgs
+        self.sites_per_org = sites_per_org
+        self.explorers_per_org = explorers_per_org
+        self.tasks_per_org = tasks_per_org
+        self.site_updates = {}      # site id -> fields set with PATCH /org/sites/{id}
+
+    def org_id(self, o):
+        return '%08x-0000-4000-8000-00000000%04x' % (0x0a000000 + o, o)
+
+    def site_id(self, o, s):
+        return '%08x-0000-4000-8000-%04x0000%04x' % (0x0b000000 + o, o, s)
+
+    def asset_id(self, i):
+        return '%08x-0000-4000-8000-%012x' % (0x0c000000 + (i >> 48), i & 0xffffffffffff)
+
+    def org_index(self, org_id):
+        for o in range(self.org_count):
+            if self.org_id(o) == org_id:
+                return o
+        return 0
+
+    def orgs(self):
+        return [{'id': self.org_id(o), 'name': 'Organization %d' % o, 'client_id': 'c0ffee00-0000-4000-8000-000000000000', 'demo': False} for o in range(self.org_count)]
+
+    def sites(self, o):
+        sites = []
+        for s in range(self.sites_per_org):
+            subnets = {}
+            for n in range(4):
+                subnets['10.%d.%d.0/24' % ((o * self.sites_per_org + s) % 256, n * 16 + (s % 16))] = {'description': 'subnet %d' % n, 'tags': {}}
+            subnets['192.168.%d.0/24' % (s % 256)] = {'description': 'shared', 'tags': {}}
+            sites.append({
+                'id': self.site_id(o, s),
+                'name': 'Site %d-%d' % (o, s),
+                'scope': '10.%d.0.0/16\n172.16.%d.1-172.16.%d.254' % ((o * self.sites_per_org + s) % 256, s % 256, s % 256),
+                'excludes': '',
+                'subnets': subnets,
+                'asset_count': self.org_assets_count(o) // self.sites_per_org,
+            })
+            sites[-1].update(self.site_updates.get(sites[-1]['id'], {}))
+        return sites
+
+    def site(self, o, site_id):
+        for site in self.sites(o):
+            if site['id'] == site_id:
+                return site
+        return None
+
+    def org_assets_count(self, o):
+        return len(range(o, self.asset_count, self.org_count))
+
+    # asset indexes that belong to an organization
+    def org_asset_indexes(self, o):
+        return range(o, self.asset_count, self.org_count)
+
+    def asset_address(self, i):
+        return '10.%d.%d.%d' % ((i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff)
+
+    def asset(self, i):
+        rng = random.Random(i)
+        o = i % self.org_count
+        s = (i // self.org_count) % self.sites_per_org
+        ts = str(1700000000 + rng.randrange(10000000))
+        return {
+            'id': self.asset_id(i),
+            'organization_id': self.org_id(o),
+            'site_id': self.site_id(o, s),
+            'addresses': [self.asset_address(i)] + (['fe80::%x' % i] if i % 3 == 0 else []),
+            'macs': ['00:16:%02x:%02x:%02x:%02x' % ((i >> 24) & 0xff, (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff)],
+            'mac_vendors': ['Dell Inc.'],
+            'names': ['HOST-%07d' % i, 'host-%07d.corp.example.com' % i],
+            'type': rng.choice(['Desktop', 'Laptop', 'Server', 'Switch']),
+            'tags': {'owner': 'it'} if i % 2 else {},
+            'os_vendor': 'Microsoft',
+            'os_product': 'Windows 11',
+            'os_version': '23H2',
+            'hw_vendor': 'Dell',
+            'hw_product': 'Latitude 7440',
+            'hw_version': '',
+            'first_seen': 1690000000,
+            'last_seen': int(ts),
+            'updated_at': int(ts),
+            'foreign_attributes': {
+                '@crowdstrike.dev': [
+                    {'ts': ts, 'hostname': 'HOST-%07d' % i, 'siteName': 'HQ', 'lastLoginUser': 'user%d' % i,
+                     'discover.systemSerialNumber': 'SN%07d' % i, 'systemManufacturer': 'Dell Inc.'},
+                    {'ts': str(int(ts) - 86400), 'hostname': 'OLD-%07d' % i, 'siteName': 'HQ'}
+                ],
+                '@intune.dev': [{'ts': ts, 'deviceName': 'HOST-%07d' % i, 'serialNumber': 'SN%07d' % i, 'userPrincipalName': 'user%d@example.com' % i}]
+            }
+        }
+
+    def services(self, i):
+        address = self.asset_address(i)
+        asset_id = self.asset_id(i)
+        return [
+            {'service_id': asset_id[:-4] + '0443', 'service_asset_id': asset_id, 'service_address': address, 'service_vhost': '', 'service_transport': 'tcp', 'service_port': 443,
+             'service_data': {'protocol': 'http\ttls', 'tls.cn': 'host-%07d.corp.example.com' % i, 'tls.issuer': 'CN=Example CA', 'tls.notAfter': '2026-01-01T00:00:00Z'}},
+            {'service_id': asset_id[:-4] + '0022', 'service_asset_id': asset_id, 'service_address': address, 'service_vhost': '', 'service_transport': 'tcp', 'service_port': 22,
+             'service_data': {'protocol': 'ssh', 'ssh.banner': 'SSH-2.0-OpenSSH_9.6'}},
+        ]
+
+    def explorers(self, o):
+        return [{
+            'id': '%08x-0000-4000-8000-%012x' % (0x0d000000 + o, e), 'name': 'explorer-%d-%d' % (o, e), 'organization_id': self.org_id(o),
+            'last_checkin': 1730000000, 'arch': 'amd64', 'os': 'Linux', 'version': 'v4.0.0', 'connected': True, 'inactive': False,
+            'external_ip': '203.0.113.%d' % e, 'internal_ip': '10.0.0.%d' % e, 'settings': {'max_concurrent_scans': 2},
+            'system_info': {'path': '/opt/runzero', 'attributes': {'CanScreenshot': 'true'}, 'mem': {'total': 8 * 2**30, 'usedPercent': 40}}
+        } for e in range(self.explorers_per_org)]
+
+    def tasks(self, o, recurring=False):
+        tasks = []
+        for t in range(self.tasks_per_org):
+            tasks.append({
+                'id': '%08x-0000-4000-8000-%012x' % (0x0e000000 + o, t), 'name': 'Task %d' % t, 'description': '', 'organization_id': self.org_id(o),
+                'organization_name': 'Organization %d' % o, 'type': 'scan', 'status': 'active' if recurring else 'processed', 'error': '',
+                'created_by': 'admin@example.com', 'created_at': 1730000000, 'updated_at': 1730000000, 'start_time': 1730000000,
+                'recur': recurring, 'recur_frequency': 'day', 'recur_last': 1730000000, 'recur_next': 1730086400,
+                'site_id': self.site_id(o, t % self.sites_per_org), 'site_name': 'Site %d-%d' % (o, t % self.sites_per_org),
+                'agent_id': '', 'agent_name': '', 'template_id': '00000000-0000-0000-0000-000000000000', 'params': {'targets': '10.0.0.0/16', 'excludes': ''},
+                'data_processing_started_at': 1730000000, 'data_processing_ended_at': 1730000060,
+                'data_acquisition_started_at': 1730000000, 'data_acquisition_ended_at': 1730000060,
+            })
+        return tasks
+
+class MockState:
+    def __init__(self, data, latency_ms=0, error_rate=0.0, seed=0):
+        self.data = data
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.by_endpoint = {}
+
+    # count a request and decide whether to inject a failure for it
+    def count(self, endpoint, can_fail=True):
+        with self.lock:
+            self.requests += 1
+            self.by_endpoint[endpoint] = self.by_endpoint.get(endpoint, 0) + 1
+            fail = can_fail and self.error_rate > 0 and self.rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+            return fail
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'errors': self.errors, 'by_endpoint': dict(self.by_endpoint)}
+
+# project a record onto a comma separated fields= list
+def project(record, fields):
+    if not fields:
+        return record
+    return {f: record.get(f) for f in fields.split(',')}
+
+# filter asset indexes with the subset of runZero search syntax understood by the mock
+def filter_assets(data, indexes, search):
+    if not search:
+        return indexes
+    site = re.search(r'site:([0-9a-f-]{36})', search)
+    if site:
+        indexes = [i for i in indexes if data.site_id(i % data.org_count, (i // data.org_count) % data.sites_per_org) == site.group(1)]
+    terms = re.findall(r'address:"?([0-9a-f.:/]+)"?', search)
+    if terms:
+        addresses = set(t for t in terms if '/' not in t)
+        networks = [ipaddress.ip_network(t, strict=False) for t in terms if '/' in t]
+        indexes = [i for i in indexes if data.asset_address(i) in addresses or
+                   (networks and any(ipaddress.ip_address(data.asset_address(i)) in n for n in networks))]
+    ids = set(re.findall(r'\bid:"?([0-9a-f-]{36})"?', search))
+    if ids:
+        indexes = [i for i in indexes if data.asset_id(i) in ids]
+    return indexes
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; without TCP_NODELAY, kept-alive connections stall on
+    # delayed acks for every response
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_response(self):
+        status = random.choice([429, 502, 503])
+        payload = b'{"error":"injected failure"}'
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # stream a json array (or raw text lines) using chunked transfer, gzip compressed when accepted
+    def send_stream(self, records, text=False):
+        gzip_ok = 'gzip' in self.headers.get('Accept-Encoding', '')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv' if text else 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        if gzip_ok:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip_ok else None
+
+        def write(data):
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+        buffer = []
+        first = True
+        if not text:
+            write(b'[')
+        for r in records:
+            if text:
+                buffer.append(r)
+            else:
+                buffer.append(('' if first else ',') + json.dumps(r))
+                first = False
+            if len(buffer) >= RECORDS_PER_CHUNK:
+                write(''.join(buffer).encode())
+                buffer = []
+        if buffer:
+            write(''.join(buffer).encode())
+        if not text:
+            write(b']')
+        if compressor:
+            tail = compressor.flush()
+            if tail:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(tail), tail))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def route(self, method):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        path = url.path[len(API_PREFIX):] if url.path.startswith(API_PREFIX) else url.path
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if path == '/__stats':
+            return self.send_json(200, self.state.stats())
+
+        endpoint = method + ' ' + re.sub(r'[0-9a-f]{8}-[0-9a-f-]{27}', '{id}', path)
+        fail = self.state.count(endpoint, can_fail=path != '/account/api/token')
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        if fail:
+            return self.send_error_response()
+
+        data = self.state.data
+        o = data.org_index(query.get('_oid', ''))
+
+        if method == 'POST' and path == '/account/api/token':
+            return self.send_json(200, {'access_token': 'mock-token-%d' % time.time_ns(), 'token_type': 'Bearer', 'expires_in': 3600})
+        if method == 'GET' and path == '/account/orgs':
+            return self.send_json(200, data.orgs())
+        if method == 'GET' and path in ('/org/sites', '/export/org/sites.json'):
+            return self.send_json(200, data.sites(o))
+        if method == 'GET' and path == '/export/org/sites.csv':
+            return self.send_stream(['id,name,scope\n'] + ['%s,%s,%s\n' % (s['id'], s['name'], s['scope'].replace('\n', ' ')) for s in data.sites(o)], text=True)
+        if method == 'GET' and path == '/org/explorers':
+            return self.send_json(200, data.explorers(o))
+        if method == 'GET' and path == '/org/tasks':
+            return self.send_json(200, data.tasks(o, 'recur' in query.get('search', '')))
+        if method == 'GET' and path == '/account/tasks':
+            search = query.get('search', '')
+            if 'agent_id' in search:
+                return self.send_json(200, [])
+            return self.send_json(200, [t for org in range(data.org_count) for t in data.tasks(org, 'recur:=true' in search)])
+        if method == 'GET' and path == '/account/tasks/templates':
+            return self.send_json(200, [{'id': '00000000-0000-0000-0000-000000000001', 'name': 'Default'}])
+        if method == 'GET' and path in ('/org/assets', '/export/org/assets.json'):
+            indexes = filter_assets(data, data.org_asset_indexes(o), query.get('search', ''))
+            fields = query.get('fields')
+            return self.send_stream(project(data.asset(i), fields) for i in indexes)
+        if method == 'GET' and path == '/export/org/services.json':
+            indexes = filter_assets(data, data.org_asset_indexes(o), query.get('search', ''))
+            return self.send_stream(s for i in indexes for s in data.services(i))
+        if method == 'PATCH' and re.fullmatch(r'/org/assets/[0-9a-f-]{36}/tags', path):
+            return self.send_json(200, {'id': path.split('/')[3]})
+        if (method, path) in (('POST', '/org/assets/bulk/delete'), ('PATCH', '/org/assets/bulk/tags')):
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if re.fullmatch(r'/org/sites/[0-9a-f-]{36}', path) and method in ('GET', 'PATCH'):
+            site_id = path.split('/')[3]
+            if method == 'PATCH':
+                with self.state.lock:
+                    data.site_updates.setdefault(site_id, {}).update(json.loads(body or b'{}'))
+            site = data.site(o, site_id)
+            if site is None:
+                return self.send_json(404, {'error': 'site not found'})
+            return self.send_json(200, site)
+        return self.send_json(404, {'error': 'not found: ' + endpoint})
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_PATCH(self):
+        self.route('PATCH')
+
+# start the mock server in a background thread and return it; base_url is set on the returned server
+def start(port=8800, **kwargs):
+    latency_ms = kwargs.pop('latency_ms', 0)
+    error_rate = kwargs.pop('error_rate', 0.0)
+    handler = type('Handler', (MockHandler,), {'state': MockState(MockData(**kwargs), latency_ms, error_rate)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.base_url = 'http://127.0.0.1:%d%s' % (server.server_address[1], API_PREFIX)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mock runZero API server')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--assets', type=int, default=10000)
+    parser.add_argument('--orgs', type=int, default=4)
+    parser.add_argument('--sites-per-org', type=int, default=5)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    server = start(args.port, assets=args.assets, orgs=args.orgs, sites_per_org=args.sites_per_org, latency_ms=args.latency_ms, error_rate=args.error_rate)
+    print('Mock runZero API listening on ' + server.base_url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# run_benchmarks.py
+#
+# Runs export_assets_to_csv, export_services_to_csv, tag_assets_cross_org and delete_bulk_assets against the
+# local mock runZero API (mock_runzero.py) and records wall time, peak RSS and requests/sec for each script.
+# Each script runs in its own process with its configuration pointed at the mock server, so peak RSS is
+# measured per script.
+#
+# Usage:
+#     python3 benchmarks/run_benchmarks.py --assets 100000 [--latency-ms 5] [--error-rate 0] [--json results.jsonl]
+#     python3 benchmarks/run_benchmarks.py --assets 1000000 --only export_assets_to_csv
+
+import argparse
+import builtins
+import importlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.join(BENCHMARK_DIR, '..')
+sys.path.insert(0, BENCHMARK_DIR)
+import mock_runzero
+
+SCRIPTS = [
+    'export_assets_to_csv',
+    'export_services_to_csv',
+    'tag_assets_cross_org',
+    'delete_bulk_assets',
+]
+
+# point a script's configuration at the mock server and the scratch directory
+def configure(module, name, base_url, workdir, args):
+    data = mock_runzero.MockData(assets=args.assets, orgs=args.orgs)
+    module.RUNZERO_BASE_URL = base_url
+    if name in ('export_assets_to_csv', 'export_services_to_csv'):
+        module.RUNZERO_ORG_ID = data.org_id(0)
+        module.RUNZERO_EXPORT_TOKEN = 'mock-export-token'
+        module.OUTPUT_FILE = os.path.join(workdir, name + '.' + module.OUTPUT_FORMAT)
+    elif name == 'tag_assets_cross_org':
+        module.RUNZERO_CLIENT_ID = 'mock-client'
+        module.RUNZERO_CLIENT_SECRET = 'mock-secret'
+        module.CSV_FILE = os.path.join(workdir, 'tag_addresses.csv')
+        module.CSV_COLUMN = 0
+        module.CSV_HEADER = True
+        step = max(1, args.assets // args.tag_addresses)
+        with open(module.CSV_FILE, 'w') as f:
+            f.write('address\n')
+            for i in range(0, args.assets, step)[:args.tag_addresses]:
+                f.write(data.asset_address(i) + '\n')
+            f.write('192.0.2.1\n')
+    elif name == 'delete_bulk_assets':
+        module.RUNZERO_ORG_ID = data.org_id(0)
+        module.RUNZERO_ORG_TOKEN = 'mock-org-token'
+        builtins.input = lambda prompt='': 'y'
+
+# child process: run one script and report its peak RSS on the last line of output
+def run_child(args):
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(args.workdir)
+    module = importlib.import_module(args.child)
+    configure(module, args.child, args.base_url, args.workdir, args)
+    module.main()
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024
+    print(json.dumps({'maxrss_kb': maxrss}))
+
+def run_script(name, server, args, workdir):
+    before = server.RequestHandlerClass.state.stats()['requests']
+    command = [sys.executable, os.path.abspath(__file__), '--child', name, '--base-url', server.base_url, '--workdir', workdir,
+               '--assets', str(args.assets), '--orgs', str(args.orgs), '--tag-addresses', str(args.tag_addresses)]
+    start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    requests_made = server.RequestHandlerClass.state.stats()['requests'] - before
+    record = {
+        'script': name,
+        'assets': args.assets,
+        'orgs': args.orgs,
+        'latency_ms': args.latency_ms,
+        'error_rate': args.error_rate,
+        'ok': result.returncode == 0,
+        'wall_s': round(wall, 3),
+        'peak_rss_mb': None,
+        'requests': requests_made,
+        'requests_per_s': round(requests_made / wall, 1) if wall else 0,
+    }
+    lines = result.stdout.strip().splitlines()
+    if result.returncode == 0 and lines:
+        record['peak_rss_mb'] = round(json.loads(lines[-1])['maxrss_kb'] / 1024, 1)
+    else:
+        print('--- ' + name + ' failed ---')
+        print('\n'.join((result.stdout + result.stderr).strip().splitlines()[-15:]))
+    return record
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark scripts against the local mock runZero API')
+    parser.add_argument('--assets', type=int, default=10000)
+    parser.add_argument('--orgs', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--tag-addresses', type=int, default=1000)
+    parser.add_argument('--only', action='append', choices=SCRIPTS)
+    parser.add_argument('--json', help='append results as json lines to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    server = mock_runzero.start(0, assets=args.assets, orgs=args.orgs, latency_ms=args.latency_ms, error_rate=args.error_rate)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.only or SCRIPTS:
+            results.append(run_script(name, server, args, workdir))
+    server.shutdown()
+
+    print(f'{"script":<26} {"ok":<4} {"wall s":>9} {"peak RSS MB":>12} {"requests":>9} {"req/s":>9}')
+    for r in results:
+        rss = '-' if r['peak_rss_mb'] is None else str(r['peak_rss_mb'])
+        print(f'{r["script"]:<26} {"yes" if r["ok"] else "no":<4} {r["wall_s"]:>9.2f} {rss:>12} {r["requests"]:>9} {r["requests_per_s"]:>9.1f}')
+
+    if args.json:
+        with open(args.json, 'a') as f:
+            for r in results:
+                r['timestamp'] = datetime.now().isoformat(timespec='seconds')
+                f.write(json.dumps(r) + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,7 @@
 #     - Custom attributes cannot be named after reserved attribute names used by runZero or they will be dropped during creation.
 #
 import uuid
-import requests
+import runzero_client
 import os
 import json
 import csv
@@ -69,7 +69,7 @@ def main():
     with open(CSV_FILE, 'r') as data:
         for a in csv.DictReader(data):
             asset = build_asset(a)
-            response = requests.post(url, json=asset, headers=header)
+            response = runzero_client.post(url, json=asset, headers=header)
             if response.status_code == 200:
                 print('successfully uploaded asset to runZero:', response.json())
             else:
@@ -1,8 +1,20 @@
 import requests
+import runzero_client
 import os
 import json
 import csv
+import sys
+import time
+import random
+import threading
+import itertools
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+import asset_index
+from runzero_export import ExportError, iter_json_array, open_export
 
 # these can be removed if you are hard coding the org id and export token
 from dotenv import load_dotenv
@@ -21,6 +33,42 @@ QUERY = 'last_seen:<30d and (type:desktop or type:laptop)'
 # define fields to be retrieved; in this case we only need the asset UUIDs
 FIELDS = 'id'
 
+# set FROM_INDEX to True or pass --from-index to resolve QUERY from the local asset index built by
+# sync_asset_index.py; QUERY must be listed in its INDEX_QUERIES. Deletions still go through the API.
+FROM_INDEX = '--from-index' in sys.argv
+
+# set PIPELINE to True or pass --pipeline to stream matching ids from the export API straight into the deletion
+# workers instead of downloading every id before deleting; memory is bounded by PIPELINE_QUEUE_DEPTH ids rather
+# than the result size. The confirmation prompt is based on a first pass that counts the matching assets; the
+# export API has no count-only request, so that pass downloads every matching id and the ids are transferred
+# twice in this mode. The ids are fetched again for deletion, so the purge stops once more ids than were
+# confirmed have arrived, e.g. when a relative query such as last_seen:<30d matches new assets in between.
+PIPELINE = '--pipeline' in sys.argv
+PIPELINE_QUEUE_DEPTH = 20000
+
+# deletion tuning
+# batches are sent by DELETE_WORKERS concurrent workers; the batch size starts at BATCH_SIZE and grows while
+# batches complete faster than TARGET_BATCH_SECONDS, and shrinks when they are slower or fail
+# rate limited (429) and server error (5xx) responses are retried up to MAX_RETRIES times with exponential
+# backoff and jitter, honouring Retry-After; failed batches are split in half before they are retried
+# these are the only retries: the deletion requests bypass the retries of the shared HTTP client
+DELETE_WORKERS = 4
+BATCH_SIZE = 1000
+BATCH_SIZE_MIN = 100
+BATCH_SIZE_MAX = 10000
+TARGET_BATCH_SECONDS = 15
+MAX_RETRIES = 5
+REQUEST_TIMEOUT = 600
+
+# ids that could not be deleted are written to this file
+FAILED_IDS_FILE = 'delete_bulk_assets_failed.txt'
+
+# every batch is recorded in an append-only journal before it is sent and again once it is deleted, and
+# each record is fsync'd; if a purge is interrupted, pass --resume to resend the batches that were not
+# committed without running the query again. Already deleted assets (404) count as deleted on replay.
+JOURNAL_FILE = 'delete_bulk_assets.journal'
+RESUME = '--resume' in sys.argv
+
 # Fetch asset UUIDS matching defined query
 def fetch_asset_uuids(query):
     asset_uuids = []
@@ -29,7 +77,7 @@ def fetch_asset_uuids(query):
         'Authorization': f"Bearer {RUNZERO_ORG_TOKEN}",
         'Content-Type': 'application/json'
     }
-    response = requests.get(url, headers=headers, timeout=600)
+    response = runzero_client.get(url, headers=headers, timeout=600)
     if response.status_code != 200:
         print(f"Error fetching assets: {response.status_code} {response.text}")
         exit(1)
@@ -41,34 +89,388 @@ def fetch_asset_uuids(query):
     
     return asset_uuids
 
-# Bulk delete assets matching list of UUIDs
-def delete_assets(asset_uuids):
-    url = f"{RUNZERO_BASE_URL}/org/assets/bulk/delete?_oid={RUNZERO_ORG_ID}"
-    headers = {
-        'Authorization': f"Bearer {RUNZERO_ORG_TOKEN}",
-        'Content-Type': 'application/json'
-    }
+# Stream asset UUIDs matching defined query from the export API without holding them in memory
+def iter_asset_uuids(query):
+    url = f"{RUNZERO_BASE_URL}/export/org/assets.json?_oid={RUNZERO_ORG_ID}&search={query}&fields={FIELDS}"
+    with open_export(url, RUNZERO_ORG_TOKEN) as assets:
+        for a in iter_json_array(assets):
+            yield a['id']
+
+# Count assets matching defined query; every matching id is downloaded, but none are kept
+def count_asset_uuids(query):
+    count = 0
+    for _ in iter_asset_uuids(query):
+        count += 1
+    return count
+
+# Producer for the pipelined mode: stream ids into a bounded queue, blocking while the deletion workers catch up
+# a None marks the end of the stream; any fetch error is recorded in errors so it can be reported afterwards,
+# and fetched is only set once the export stream was read to its end. Setting stop ends the producer early.
+def queue_asset_uuids(query, ids_queue, errors, fetched, stop):
+    def put(item):
+        while not stop.is_set():
+            try:
+                ids_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for asset_uuid in iter_asset_uuids(query):
+            if not put(asset_uuid):
+                return
+        fetched.set()
+    except Exception as e:
+        errors.append(repr(e))
+    finally:
+        put(None)
+
+# yield ids from the queue until the end of the stream, or until limit ids have been taken and another one
+# arrives, which sets exceeded
+def iter_queue(ids_queue, limit=None, exceeded=None):
+    taken = 0
+    while True:
+        asset_uuid = ids_queue.get()
+        if asset_uuid is None:
+            return
+        if limit is not None and taken >= limit:
+            exceeded.set()
+            return
+        taken += 1
+        yield asset_uuid
 
-    batch_size = 1000
-    total_assets = len(asset_uuids)
+# Fetch and delete at the same time: ids are deleted as soon as enough have arrived to fill a batch
+# limit is the number of assets the user confirmed; no more than that are deleted
+def pipeline_delete_assets(query, journal, replay=None, limit=None):
+    ids_queue = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+    errors = []
+    fetched = threading.Event()
+    stop = threading.Event()
+    exceeded = threading.Event()
+    producer = threading.Thread(target=queue_asset_uuids, args=(query, ids_queue, errors, fetched, stop), daemon=True)
+    producer.start()
+    try:
+        result = delete_assets(iter_queue(ids_queue, limit, exceeded), journal, replay, complete=False)
+    finally:
+        stop.set()
+    producer.join()
+    if exceeded.is_set():
+        # every confirmed id has been batched, so the purge is complete; the rest needs a new confirmation
+        print(f"More than the {limit} confirmed assets now match the query, so deletion stopped after {limit}. Run the script again to review the rest.")
+        journal.write({'type': 'fetched'})
+        return result
+    if errors or not fetched.is_set():
+        reason = errors[0] if errors else 'the export stream ended early'
+        print(f"Error fetching assets, deletion stopped early: {reason}. Run with --resume to continue.")
+        journal.close()
+        exit(1)
+    journal.write({'type': 'fetched'})
+    return result
+
+# Look up asset UUIDs matching defined query in the local asset index
+def fetch_asset_uuids_from_index(query):
+    index = asset_index.open_index()
+    age = asset_index.index_age(index)
+    asset_uuids = asset_index.get_query_matches(index, query, RUNZERO_ORG_ID)
+    index.close()
+    if age is None:
+        print("The local asset index has not been synced. Run sync_asset_index.py first.")
+        exit(1)
+    if asset_uuids is None:
+        print("Query is not in the local asset index. Add it to INDEX_QUERIES in sync_asset_index.py and run the sync.")
+        exit(1)
+    print(f"Using local asset index synced {int(age / 60)} minutes ago.")
+    return asset_uuids
+
+# Parse a Retry-After header given in seconds or as an HTTP date
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Append-only, fsync'd journal of deletion batches
+# records are json lines: start (org and query), pending (batch number and ids), committed, failed and split
+# (a batch that was divided into new batches for retry), fetched once every matching id has been batched, and
+# done when the purge completed without failures
+class DeleteJournal:
+    def __init__(self, path, next_batch=1):
+        self.file = open(path, 'a')
+        self.next_batch = next_batch
 
-    for a in range(0, total_assets, batch_size):
-        batch_uuids = asset_uuids[a:a + batch_size]
-        data = {
-            "asset_ids": batch_uuids
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    # journal a new batch and return its number
+    def add_batch(self, ids):
+        number = self.next_batch
+        self.next_batch += 1
+        self.write({'type': 'pending', 'batch': number, 'ids': ids})
+        return number
+
+    def close(self):
+        self.file.close()
+
+# Read a journal and return its start record, the batches that were not committed, whether every matching
+# id was batched, whether the purge finished, and the next free batch number
+def read_journal(path):
+    start = None
+    pending = {}
+    fetched = False
+    done = False
+    last_batch = 0
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a record cut short by a crash was never fsync'd, so its batch was never sent
+                continue
+            if record['type'] == 'start':
+                start = record
+            elif record['type'] == 'pending':
+                pending[record['batch']] = record['ids']
+                last_batch = max(last_batch, record['batch'])
+            elif record['type'] in ('committed', 'split'):
+                pending.pop(record['batch'], None)
+            elif record['type'] == 'fetched':
+                fetched = True
+            elif record['type'] == 'done':
+                done = True
+    # failed batches stay unresolved so a resume retries them, e.g. after an expired token was replaced
+    return start, pending, fetched, done, last_batch + 1
+
+# Concurrent bulk deletion with adaptive batch sizes and retries
+# ids are pulled from any iterable as batches are formed, so the ids do not need to be known up front;
+# batches left over from an interrupted run can be passed in as replay (batch number to ids)
+class BatchDeleter:
+    def __init__(self, asset_uuids, journal, replay=None):
+        self.url = f"{RUNZERO_BASE_URL}/org/assets/bulk/delete?_oid={RUNZERO_ORG_ID}"
+        self.headers = {
+            'Authorization': f"Bearer {RUNZERO_ORG_TOKEN}",
+            'Content-Type': 'application/json'
         }
-        response = requests.post(url, headers=headers, json=data, timeout=600)
-        if response.status_code == 204:
-            print(f"Successfully deleted batch of {len(batch_uuids)} assets.")
+        self.source = iter(asset_uuids)
+        self.source_done = False
+        self.reading = False
+        self.journal = journal
+        self.lock = threading.Lock()
+        self.batch_size = BATCH_SIZE
+        self.retry_queue = deque((number, ids, 0, 0) for number, ids in (replay or {}).items())
+        self.in_flight = 0
+        self.paused_until = 0
+        self.deleted = 0
+        self.retried_ids = set()
+        self.failed_ids = []
+
+    # Take the next batch: a retry whose backoff has expired, otherwise fresh ids from the source
+    # returns None when there is nothing left to do, or an empty batch when the caller should wait
+    # ids are read from the source outside the lock, since in pipelined mode that waits for the export, and by
+    # one worker at a time; the batch being read counts as in flight so no worker finishes early
+    def next_batch(self):
+        with self.lock:
+            now = time.time()
+            if self.retry_queue and self.retry_queue[0][3] <= now and self.paused_until <= now:
+                number, batch, attempt, _ = self.retry_queue.popleft()
+                self.in_flight += 1
+                return number, batch, attempt
+            if self.source_done or self.reading or self.paused_until > now:
+                if self.source_done and not self.retry_queue and self.in_flight == 0:
+                    return None
+                return 0, [], 0
+            self.reading = True
+            self.in_flight += 1
+            batch_size = self.batch_size
+
+        batch = []
+        try:
+            batch = list(itertools.islice(self.source, batch_size))
+        finally:
+            with self.lock:
+                self.reading = False
+                if not batch:
+                    self.in_flight -= 1
+                    self.source_done = True
+        if not batch:
+            return 0, [], 0
+        with self.lock:
+            return self.journal.add_batch(batch), batch, 0
+
+    def record_success(self, number, batch, elapsed):
+        with self.lock:
+            self.in_flight -= 1
+            self.deleted += len(batch)
+            self.journal.write({'type': 'committed', 'batch': number})
+            # grow the batch size while batches are fast, shrink it when they are slow
+            if elapsed < TARGET_BATCH_SECONDS / 2:
+                self.batch_size = min(BATCH_SIZE_MAX, int(self.batch_size * 1.5))
+            elif elapsed > TARGET_BATCH_SECONDS:
+                self.batch_size = max(BATCH_SIZE_MIN, self.batch_size // 2)
+            print(f"Successfully deleted batch of {len(batch)} assets in {elapsed:.1f}s ({self.deleted} deleted so far).")
+
+    def record_retry(self, number, batch, attempt, reason, retry_after=None):
+        with self.lock:
+            self.in_flight -= 1
+            self.batch_size = max(BATCH_SIZE_MIN, self.batch_size // 2)
+            if attempt >= MAX_RETRIES:
+                print(f"Giving up on batch of {len(batch)} assets after {attempt + 1} attempts: {reason}")
+                self.journal.write({'type': 'failed', 'batch': number})
+                self.failed_ids.extend(batch)
+                return
+            delay = retry_after if retry_after is not None else min(60, 2 ** attempt)
+            delay += random.uniform(0, delay / 2 + 0.5)
+            if retry_after is not None:
+                # the server asked everyone to slow down, so pause all workers
+                self.paused_until = max(self.paused_until, time.time() + delay)
+            print(f"Retrying batch of {len(batch)} assets in {delay:.1f}s: {reason}")
+            self.retried_ids.update(batch)
+            half = len(batch) // 2
+            if half >= BATCH_SIZE_MIN:
+                # journal both halves before the original batch is marked as split
+                parts = [(self.journal.add_batch(part), part) for part in (batch[:half], batch[half:])]
+                self.journal.write({'type': 'split', 'batch': number, 'into': [n for n, _ in parts]})
+            else:
+                parts = [(number, batch)]
+            for part_number, part in parts:
+                self.retry_queue.append((part_number, part, attempt + 1, time.time() + delay))
+
+    def record_failure(self, number, batch, reason):
+        with self.lock:
+            self.in_flight -= 1
+            print(f"Error deleting batch of {len(batch)} assets: {reason}")
+            self.journal.write({'type': 'failed', 'batch': number})
+            self.failed_ids.extend(batch)
+
+    def post_batch(self, number, batch, attempt):
+        start = time.time()
+        try:
+            response = runzero_client.post(self.url, headers=self.headers, json={"asset_ids": batch}, timeout=REQUEST_TIMEOUT, retries=False)
+        except requests.RequestException as e:
+            self.record_retry(number, batch, attempt, str(e))
+            return
+        elapsed = time.time() - start
+        # 404 means the assets are already gone, e.g. when a batch is replayed after a crash
+        if response.status_code in (200, 204, 404):
+            self.record_success(number, batch, elapsed)
+        elif response.status_code == 429 or response.status_code >= 500:
+            self.record_retry(number, batch, attempt, f"{response.status_code} {response.text[:200]}", parse_retry_after(response.headers.get('Retry-After')))
         else:
-            print(f"Error deleting assets: {response.status_code} {response.text}")
-    return
+            self.record_failure(number, batch, f"{response.status_code} {response.text[:200]}")
+
+    def worker(self):
+        while True:
+            task = self.next_batch()
+            if task is None:
+                return
+            number, batch, attempt = task
+            if not batch:
+                time.sleep(0.2)
+                continue
+            self.post_batch(number, batch, attempt)
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+            for _ in range(DELETE_WORKERS):
+                executor.submit(self.worker)
+        return self.deleted, self.failed_ids, self.retried_ids
+
+# Start a new journal for a purge, replacing the journal of a finished one
+def start_journal(query):
+    if os.path.exists(JOURNAL_FILE):
+        os.remove(JOURNAL_FILE)
+    journal = DeleteJournal(JOURNAL_FILE)
+    journal.write({'type': 'start', 'org_id': RUNZERO_ORG_ID, 'query': query, 'time': datetime.now().isoformat()})
+    return journal
+
+# Bulk delete assets matching list of UUIDs and report a final tally
+# complete tells the journal that asset_uuids held every matching id, so a resume does not need the query
+def delete_assets(asset_uuids, journal, replay=None, complete=True):
+    deleted, failed_ids, retried_ids = BatchDeleter(asset_uuids, journal, replay).run()
+    if complete:
+        journal.write({'type': 'fetched'})
+    print(f"Deleted {deleted} assets, {len(failed_ids)} failed, {len(retried_ids)} needed at least one retry.")
+    if failed_ids:
+        with open(FAILED_IDS_FILE, 'w') as f:
+            f.write('\n'.join(failed_ids) + '\n')
+        print(f"Ids of assets that could not be deleted were saved to {FAILED_IDS_FILE}. Run with --resume to retry them.")
+    return deleted, failed_ids, retried_ids
+
+# Finish a purge: mark the journal done unless there is something left to resume
+def finish_journal(journal, failed_ids):
+    if not failed_ids:
+        journal.write({'type': 'done'})
+    journal.close()
+
+# Continue an interrupted purge from its journal
+def resume():
+    if not os.path.exists(JOURNAL_FILE):
+        print(f"No journal found at {JOURNAL_FILE}. Nothing to resume.")
+        exit(1)
+    start, pending, fetched, done, next_batch = read_journal(JOURNAL_FILE)
+    if done or start is None:
+        print(f"The purge recorded in {JOURNAL_FILE} already finished. Nothing to resume.")
+        return
+    if start['org_id'] != RUNZERO_ORG_ID:
+        print(f"The journal belongs to organization {start['org_id']}, not {RUNZERO_ORG_ID}. Exiting.")
+        exit(1)
+
+    count = sum(len(ids) for ids in pending.values())
+    print(f"Resuming purge started {start['time']} for query: {start['query']}.")
+    print(f"{count} assets in {len(pending)} batches were not confirmed as deleted.")
+    if not fetched:
+        # ids that were never batched are not in the journal; deleted assets no longer match the query,
+        # so running it again only returns the assets that are left
+        print("The purge stopped before every matching asset was fetched; the query will be run again for the rest.")
+
+    confirm = input(f"Do you wish to proceed with deleting these assets? (y/n): ").lower().strip()
+    if confirm != 'y':
+        print("Exiting without deleting assets.")
+        return
+
+    journal = DeleteJournal(JOURNAL_FILE, next_batch)
+    if fetched:
+        _, failed_ids, _ = delete_assets([], journal, pending)
+    elif FROM_INDEX:
+        _, failed_ids, _ = delete_assets(fetch_asset_uuids_from_index(start['query']), journal, pending)
+    elif PIPELINE:
+        _, failed_ids, _ = pipeline_delete_assets(start['query'], journal, pending)
+    else:
+        _, failed_ids, _ = delete_assets(fetch_asset_uuids(start['query']), journal, pending)
+    finish_journal(journal, failed_ids)
 
 def main():
 
-    # Fetch list of UUIDs for assets matching the query
-    asset_uuids = fetch_asset_uuids(QUERY)
-    count = len(asset_uuids)
+    if RESUME:
+        resume()
+        return
+
+    # Refuse to start over while an interrupted purge can still be resumed
+    if os.path.exists(JOURNAL_FILE) and not read_journal(JOURNAL_FILE)[3]:
+        print(f"An unfinished purge is recorded in {JOURNAL_FILE}. Run with --resume to continue it, or remove the journal to start over.")
+        exit(1)
+
+    # Count assets matching the query; in pipelined mode the ids are fetched again while deleting
+    if FROM_INDEX:
+        asset_uuids = fetch_asset_uuids_from_index(QUERY)
+        count = len(asset_uuids)
+    elif PIPELINE:
+        try:
+            count = count_asset_uuids(QUERY)
+        except (ExportError, ValueError, requests.RequestException) as e:
+            print(f"Error counting assets: {e}")
+            exit(1)
+    else:
+        asset_uuids = fetch_asset_uuids(QUERY)
+        count = len(asset_uuids)
     
     if count == 0:
         print("No assets found matching the query. Exiting.")
@@ -81,7 +483,12 @@ def main():
 
     if confirm == 'y':
         print("Deleting assets...")
-        delete_assets(asset_uuids)
+        journal = start_journal(QUERY)
+        if PIPELINE and not FROM_INDEX:
+            _, failed_ids, _ = pipeline_delete_assets(QUERY, journal, limit=count)
+        else:
+            _, failed_ids, _ = delete_assets(asset_uuids, journal)
+        finish_journal(journal, failed_ids)
         return
     elif confirm == 'n':
         print("Exiting without deleting assets.")
@@ -1,8 +1,16 @@
 import requests
 import os
 import json
-import csv
+import math
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from runzero_export import ExportError, iter_json_array, open_export, open_writer
+import asset_index
 
 # these can be removed if you are hard coding the org id and export token
 from dotenv import load_dotenv
@@ -14,16 +22,44 @@ RUNZERO_ORG_ID = os.getenv('RUNZERO_ORG_ID')
 RUNZERO_EXPORT_TOKEN = os.getenv('RUNZERO_EXPORT_TOKEN')
 RUNZERO_BASE_URL = 'https://console.runZero.com/api/v1.0'
 
-# set the path of export files
-CSV_FILE = '/Users/doug/Documents/Projects/runzero-scripts/export_assets.csv'
+# set the format and path of export files
+# supported formats are csv, jsonl.gz, parquet and arrow; parquet and arrow require pyarrow
+OUTPUT_FORMAT = 'csv'
+OUTPUT_FILE = '/Users/doug/Documents/Projects/runzero-scripts/export_assets.' + OUTPUT_FORMAT
 
 # define runzero asset query; this should match a valid query within the platform
 # sample asset query looks looks for all desktops and laptops seen within the last 30 days
 QUERY = 'last_seen:<30days and (type:desktop or type:laptop or name:desktop or name:laptop)'
 
+# optional sharded export for large orgs; QUERY is split into smaller exports that are fetched
+# concurrently, merged into one output and de-duplicated on asset id
+# set SHARD_MODE to 'site' for one export per site or 'time' for one export per last_seen window
+# a failed shard is retried on its own; assets it already delivered are skipped by the de-duplication
+SHARD_MODE = None
+SHARD_WORKERS = 4
+SHARD_RETRIES = 2
+
+# last_seen window boundaries in hours for the 'time' shard mode
+# the last window is open ended so assets older than the final boundary are still exported
+SHARD_TIME_WINDOWS = [24, 72, 168, 336, 720]
+
+# optional incremental export; each run only fetches assets updated or seen since the last successful
+# run and merges them into a local sqlite snapshot keyed by asset id, then regenerates the full
+# output from the snapshot
+# assets that no longer match QUERY or were deleted are removed by an id-only reconciliation pass
+# that runs every RECONCILE_INTERVAL_HOURS; changing QUERY discards the snapshot and starts over
+INCREMENTAL = False
+SNAPSHOT_DB = '/Users/doug/Documents/Projects/runzero-scripts/export_assets_snapshot.db'
+RECONCILE_INTERVAL_HOURS = 24
+
+# set FROM_INDEX to True or pass --from-index to export from the local asset index built by
+# sync_asset_index.py; QUERY must be listed in its INDEX_QUERIES
+# the index only holds id, addresses, macs, names, type, site_id and tags, so other attributes are left empty
+FROM_INDEX = '--from-index' in sys.argv
+
 # define attributes that will be exported to csv
 # attributes must match keys in an assets json export
-# if an attribute is presented as an array, it should be added to an if statement below that parses arrays
+# if an attribute is presented as an array, it should be added to LIST_ATTRIBUTES below
 ASSET_ATTRIBUTES = [
     'id',
     'addresses',
@@ -61,62 +97,365 @@ ASSET_ATTRIBUTES = [
     '@intune.dev.userPrincipalName',
 ]
 
+# optional coalesced columns added after ASSET_ATTRIBUTES
+# each column takes the first non-empty value from its list of attributes, in order
+# sample column takes the serial number from crowdstrike and falls back to intune
+COALESCED_ATTRIBUTES = {
+    'serial_number': ['@crowdstrike.dev.discover.systemSerialNumber', '@intune.dev.serialNumber'],
+}
+
+# attributes that are presented as an array or object
+# these are flattened into a single value in csv output and kept as lists in other formats
+LIST_ATTRIBUTES = {'names', 'addresses', 'macs', 'mac_vendors', 'tags'}
+
+# split a foreign attribute such as @crowdstrike.dev.hostname into its source and attribute
+def split_foreign_attribute(a):
+    split_a = a.split('.',2)
+    return split_a[0] + '.' + split_a[1], split_a[2]
+
+# compile the attribute list into an extraction plan once at startup
+# plain and list columns are read straight from the asset; foreign attribute columns are grouped
+# by source so each asset resolves each foreign source once rather than once per column
+def compile_attribute_plan(attributes, coalesced_attributes=None):
+    coalesced_attributes = coalesced_attributes or {}
+    plain_columns = []
+    list_columns = []
+    foreign_columns = {}
+    for a in attributes:
+        if a in LIST_ATTRIBUTES:
+            list_columns.append(a)
+        elif a.startswith('@'):
+            source, foreign_attribute = split_foreign_attribute(a)
+            foreign_columns.setdefault(source, []).append((a, foreign_attribute))
+        else:
+            plain_columns.append(a)
+
+    # coalesced columns hold (source, attribute) candidates; source is None for regular asset attributes
+    coalesced_columns = []
+    sources = list(foreign_columns)
+    for column, candidates in coalesced_attributes.items():
+        if column in attributes:
+            raise ValueError('Coalesced column ' + column + ' is already defined in ASSET_ATTRIBUTES')
+        resolved = []
+        for a in candidates:
+            if a.startswith('@'):
+                source, foreign_attribute = split_foreign_attribute(a)
+                if source not in sources:
+                    sources.append(source)
+                resolved.append((source, foreign_attribute))
+            else:
+                resolved.append((None, a))
+        coalesced_columns.append((column, resolved))
+
+    return {
+        'columns': list(attributes) + list(coalesced_attributes),
+        'plain': plain_columns,
+        'list': list_columns,
+        'foreign': list(foreign_columns.items()),
+        'coalesced': coalesced_columns,
+        'sources': sources
+    }
+
+# return the newest record for a foreign source in a single pass
+# the timestamp of each record is parsed once; the first record wins a tie
+def newest_foreign_record(foreign_asset_records):
+    most_recent_foreign_asset = foreign_asset_records[0]
+    if len(foreign_asset_records) == 1:
+        return most_recent_foreign_asset
+    most_recent_timestamp = None
+    for f in foreign_asset_records:
+        try:
+            timestamp = int(f.get('ts', '0'))
+        except (TypeError, ValueError):
+            timestamp = 0
+        if most_recent_timestamp is None or timestamp > most_recent_timestamp:
+            most_recent_foreign_asset = f
+            most_recent_timestamp = timestamp
+    return most_recent_foreign_asset
+
+# resolve the newest record for every foreign source used by the plan
+def resolve_foreign_records(asset, sources):
+    foreign_attributes = asset.get('foreign_attributes') or {}
+    resolved = {}
+    for source in sources:
+        foreign_asset_records = foreign_attributes.get(source)
+        if foreign_asset_records:
+            resolved[source] = newest_foreign_record(foreign_asset_records)
+    return resolved
+
+# parse relevant attributes from an asset record using a compiled attribute plan
+def parse_asset(asset, plan):
+    record = {}
+    for a in plan['plain']:
+        record[a] = asset.get(a, '')
+
+    # arrays and objects are kept as is; csv output flattens them into a single value
+    for a in plan['list']:
+        record[a] = asset.get(a, '')
+
+    # handle foreign asset attributes from the newest record of each source
+    newest = resolve_foreign_records(asset, plan['sources'])
+    for source, columns in plan['foreign']:
+        most_recent_foreign_asset = newest.get(source)
+        if most_recent_foreign_asset is None:
+            continue
+        for column, foreign_attribute in columns:
+            record[column] = most_recent_foreign_asset.get(foreign_attribute, '')
+
+    # handle coalesced columns by taking the first non-empty candidate
+    for column, candidates in plan['coalesced']:
+        value = ''
+        for source, attribute in candidates:
+            if source is None:
+                value = asset.get(attribute, '')
+            else:
+                value = newest.get(source, {}).get(attribute, '')
+            if value not in ('', None):
+                break
+        record[column] = value
+
+    return record
+
+# stream asset records matching a query from /export/org/assets.json
+# fields optionally limits the attributes returned for each asset
+def iter_export_assets(query, fields=None):
+    url = f'{RUNZERO_BASE_URL}/export/org/assets.json?_oid={RUNZERO_ORG_ID}&search={query}'
+    if fields:
+        url += f'&fields={fields}'
+    with open_export(url, RUNZERO_EXPORT_TOKEN) as assets:
+        for asset in iter_json_array(assets):
+            yield asset
+    print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + assets.summary('assets export'))
+
+# get all sites within the organization
+def get_sites():
+    url = f'{RUNZERO_BASE_URL}/export/org/sites.json?_oid={RUNZERO_ORG_ID}'
+    with open_export(url, RUNZERO_EXPORT_TOKEN) as sites:
+        return list(iter_json_array(sites))
+
+# split a query into one query per site or per last_seen window
+def build_shard_queries(query, shard_mode):
+    if shard_mode == 'site':
+        return [f'site:{s["id"]} and ({query})' for s in get_sites()]
+    elif shard_mode == 'time':
+        # windows overlap by an hour so assets that move across a boundary during the export are not missed
+        queries = []
+        lower = 0
+        for upper in SHARD_TIME_WINDOWS:
+            if lower:
+                queries.append(f'last_seen:>{lower}hours and last_seen:<{upper + 1}hours and ({query})')
+            else:
+                queries.append(f'last_seen:<{upper + 1}hours and ({query})')
+            lower = upper
+        queries.append(f'last_seen:>{lower}hours and ({query})')
+        return queries
+    else:
+        raise ValueError('Unsupported shard mode ' + str(shard_mode) + '; expected site or time')
+
+# fetch shard queries concurrently and stream-merge the assets into a single iterator
+# workers hand assets over through a bounded queue so memory does not grow with the export size
+def iter_sharded_assets(queries, workers=SHARD_WORKERS, retries=SHARD_RETRIES):
+    results = queue.Queue(maxsize=10000)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # every shard ends with done or an error on the queue, even when it fails with an unexpected exception,
+    # so the consumer below never waits for a worker that has already died
+    # shards that only start after the export was stopped do not request anything
+    def fetch_shard(query):
+        if stop.is_set():
+            return
+        try:
+            fetch_shard_once(query)
+        except BaseException as e:
+            put(ExportError('Shard failed: ' + query + '. ' + repr(e)))
+
+    def fetch_shard_once(query):
+        attempt = 0
+        while True:
+            try:
+                for asset in iter_export_assets(query):
+                    if not put(asset):
+                        return
+                put(done)
+                return
+            except (ExportError, requests.RequestException, ValueError) as e:
+                attempt += 1
+                if attempt > retries or stop.is_set():
+                    put(ExportError('Shard failed after ' + str(attempt) + ' attempts: ' + query + '. ' + str(e)))
+                    return
+                print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'retrying shard ' + query + ' after error: ' + str(e))
+
+    seen_ids = set()
+    remaining = len(queries)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for query in queries:
+            executor.submit(fetch_shard, query)
+        try:
+            while remaining:
+                item = results.get()
+                if item is done:
+                    remaining -= 1
+                    continue
+                if isinstance(item, ExportError):
+                    raise item
+
+                # skip assets already delivered by an overlapping or retried shard
+                asset_id = item.get('id')
+                if asset_id in seen_ids:
+                    continue
+                seen_ids.add(asset_id)
+                yield item
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+# fetch assets matching a query, sharded if SHARD_MODE is set
+def fetch_assets(query):
+    if SHARD_MODE:
+        queries = build_shard_queries(query, SHARD_MODE)
+        print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'exporting assets from /export/org/assets.json in ' + str(len(queries)) + ' ' + SHARD_MODE + ' shards with ' + str(SHARD_WORKERS) + ' workers')
+        return iter_sharded_assets(queries)
+    else:
+        print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'exporting assets from /export/org/assets.json (this may take a few minutes)')
+        return iter_export_assets(query)
+
+# open the local asset snapshot used by incremental exports
+def open_snapshot(path):
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('CREATE TABLE IF NOT EXISTS assets (id TEXT PRIMARY KEY, data TEXT NOT NULL)')
+    db.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+    return db
+
+def get_snapshot_state(db, key):
+    row = db.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+def set_snapshot_state(db, key, value):
+    db.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, str(value)))
+
+# insert or replace assets in the snapshot in batches
+def merge_snapshot(db, assets, batch_size=1000):
+    merged = 0
+    batch = []
+    for asset in assets:
+        batch.append((asset['id'], json.dumps(asset)))
+        if len(batch) >= batch_size:
+            db.executemany('INSERT OR REPLACE INTO assets (id, data) VALUES (?, ?)', batch)
+            merged += len(batch)
+            batch = []
+    if batch:
+        db.executemany('INSERT OR REPLACE INTO assets (id, data) VALUES (?, ?)', batch)
+        merged += len(batch)
+    return merged
+
+# remove snapshot assets that no longer match the query, using an id-only export
+def reconcile_snapshot(db, query):
+    print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'reconciling snapshot against an id-only export')
+    db.execute('CREATE TEMP TABLE IF NOT EXISTS current_ids (id TEXT PRIMARY KEY)')
+    db.execute('DELETE FROM current_ids')
+    batch = []
+    for asset in iter_export_assets(query, fields='id'):
+        batch.append((asset['id'],))
+        if len(batch) >= 10000:
+            db.executemany('INSERT OR IGNORE INTO current_ids (id) VALUES (?)', batch)
+            batch = []
+    if batch:
+        db.executemany('INSERT OR IGNORE INTO current_ids (id) VALUES (?)', batch)
+    return db.execute('DELETE FROM assets WHERE id NOT IN (SELECT id FROM current_ids)').rowcount
+
+# bring the snapshot up to date with the assets matching the query
+# the high water mark is the start time of the last successful run; the delta window is padded by an
+# hour so assets updated while that run was in progress are fetched again
+def sync_snapshot(db, query):
+    run_started = time.time()
+    high_water_mark = get_snapshot_state(db, 'high_water_mark')
+    if get_snapshot_state(db, 'query') != query:
+        high_water_mark = None
+
+    if high_water_mark is None:
+        print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'no usable snapshot found; running a full export')
+        db.execute('DELETE FROM assets')
+        merged = merge_snapshot(db, fetch_assets(query))
+        set_snapshot_state(db, 'last_reconcile', run_started)
+    else:
+        hours = math.ceil((run_started - float(high_water_mark)) / 3600) + 1
+        print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'fetching assets updated or seen in the last ' + str(hours) + ' hours')
+        merged = merge_snapshot(db, fetch_assets(f'(updated_at:<{hours}hours or last_seen:<{hours}hours) and ({query})'))
+        last_reconcile = float(get_snapshot_state(db, 'last_reconcile') or 0)
+        if run_started - last_reconcile >= RECONCILE_INTERVAL_HOURS * 3600:
+            removed = reconcile_snapshot(db, query)
+            print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'removed ' + str(removed) + ' assets that no longer match the query')
+            set_snapshot_state(db, 'last_reconcile', run_started)
+
+    set_snapshot_state(db, 'query', query)
+    set_snapshot_state(db, 'high_water_mark', run_started)
+    db.commit()
+    print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'merged ' + str(merged) + ' assets into snapshot ' + SNAPSHOT_DB)
+
+# stream all assets from the snapshot
+def iter_snapshot_assets(db):
+    for (data,) in db.execute('SELECT data FROM assets ORDER BY id'):
+        yield json.loads(data)
+
+# look up assets matching a query in the local asset index
+def fetch_assets_from_index(query, plan):
+    index = asset_index.open_index()
+    asset_ids = asset_index.get_query_matches(index, query, RUNZERO_ORG_ID)
+    if asset_ids is None:
+        raise ExportError('Query is not in the local asset index. Add it to INDEX_QUERIES in sync_asset_index.py and run the sync.')
+    missing = [a for a in plan['plain'] + plan['list'] if a not in asset_index.INDEX_FIELDS.split(',')]
+    if missing or plan['foreign']:
+        print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'attributes not held in the local asset index will be empty')
+    print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'exporting ' + str(len(asset_ids)) + ' assets from the local asset index')
+    assets = asset_index.get_assets_by_id(index, asset_ids)
+    index.close()
+    return assets
+
+# parse relevant attributes from asset records and write each row as soon as it is built
+def write_output(assets, plan):
+    asset_count = 0
+    writer = open_writer(OUTPUT_FILE, OUTPUT_FORMAT, plan['columns'], plan['list'])
+    try:
+        for asset in assets:
+            writer.write(parse_asset(asset, plan))
+            asset_count += 1
+    finally:
+        writer.close()
+    return asset_count
+
 def main():
 
     # export asset records based on defined query
-    print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'exporting assets from /export/org/assets.json (this may take a few minutes)')
-    url = f'{RUNZERO_BASE_URL}/export/org/assets.json?_oid={RUNZERO_ORG_ID}&search={QUERY}'
-    header = {"Content-Type": "application/json", "Authorization": "Bearer " + RUNZERO_EXPORT_TOKEN}
-    assets = requests.get(url, headers=header)
-    if assets.status_code != 200:
-        print('Failed to export assets from ' + url)
-        exit(1)    
-    assets_json = assets.json()
-
-    # parse relevant attributes from asset records
-    print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'parsing defined attributes')
-    output = []
-    for asset in assets_json:
-        record = {}
-        for a in ASSET_ATTRIBUTES: 
-            
-            # handle attributes that are presented as an array        
-            if a == 'names' or a == 'addresses' or a == 'macs' or a == 'mac_vendors' or a == 'tags':
-                attrib = json.dumps(asset.get(a,''))
-                attrib = attrib.replace('[','').replace(']','').replace('{','').replace('}','').replace('"','')
-                record[a] = attrib
-            
-            # handle foreign asset attributes
-            elif a.startswith('@'):  
-                split_a = a.split('.',2)
-                foreign_attribute_source = split_a[0] + '.' + split_a[1]
-                foreign_attribute = split_a[2]
-                foreign_asset_records = []
-                foreign_asset_records = asset.get('foreign_attributes', {}).get(foreign_attribute_source, [])
-
-                # check for one or more of the same foreign asset attribute and take the newest
-                if foreign_asset_records:
-                    if len(foreign_asset_records) > 1:
-                        most_recent_foreign_asset = foreign_asset_records[0]
-                        for f in foreign_asset_records:
-                            timestamp = int(f.get('ts', '0'))
-                            most_recent_timestamp = int(most_recent_foreign_asset.get('ts', '0'))
-                            if timestamp > most_recent_timestamp:
-                                most_recent_foreign_asset = f
-                            record[a] = most_recent_foreign_asset.get(foreign_attribute, '')
-                    else:
-                        record[a] = foreign_asset_records[0].get(foreign_attribute, '')
-            else:    
-                record[a] = asset.get(a, '')
-
-        output.append(record)
-
-    # export assets to csv file
-    with open(CSV_FILE, mode='w') as file:
-        writer = csv.DictWriter(file, fieldnames=ASSET_ATTRIBUTES)
-        writer.writeheader()
-        writer.writerows(output)
-        print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'assets saved to ' + CSV_FILE)
+    # the response is streamed so assets are parsed and written as they arrive instead of being loaded all at once
+    plan = compile_attribute_plan(ASSET_ATTRIBUTES, COALESCED_ATTRIBUTES)
+    try:
+        if FROM_INDEX:
+            asset_count = write_output(fetch_assets_from_index(QUERY, plan), plan)
+        elif INCREMENTAL:
+            db = open_snapshot(SNAPSHOT_DB)
+            try:
+                sync_snapshot(db, QUERY)
+                asset_count = write_output(iter_snapshot_assets(db), plan)
+            finally:
+                db.close()
+        else:
+            asset_count = write_output(fetch_assets(QUERY), plan)
+    except ExportError as e:
+        print(e)
+        exit(1)
+
+    print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + str(asset_count) + ' assets saved to ' + OUTPUT_FILE)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
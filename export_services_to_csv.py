@@ -1,8 +1,6 @@
-import requests
 import os
-import json
-import csv
 from dotenv import load_dotenv
+from runzero_export import ExportError, iter_json_array, open_export, open_writer, write_discovered_columns
 
 # load global variables from .env file
 load_dotenv()
@@ -10,8 +8,10 @@ RUNZERO_ORG_ID = os.getenv('RUNZERO_ORG_ID')
 RUNZERO_EXPORT_TOKEN = os.getenv('RUNZERO_EXPORT_TOKEN')
 RUNZERO_BASE_URL = 'https://console.runZero.com/api/v1.0'
 
-# set path of export files
-CSV_FILE = '/Users/doug/Documents/Projects/runzero-scripts/export_services.csv'
+# set format and path of export files
+# supported formats are csv, jsonl.gz, parquet and arrow; parquet and arrow require pyarrow
+OUTPUT_FORMAT = 'csv'
+OUTPUT_FILE = '/Users/doug/Documents/Projects/runzero-scripts/export_services.' + OUTPUT_FORMAT
 
 # define runzero services query
 # sample service query looks for tls certificates expiring in the next 30 days
@@ -28,6 +28,7 @@ ATTRIBUTES = [
 
 # optional list of service_data attributes to include in csv
 # if empty, all service_data attributes will be exported
+# the columns are then discovered from every service in a first pass over a temporary file, so no keys are dropped
 SERVICE_DATA_ATTRIBUTES = [
     'tls.cn',
     'tls.issuer',
@@ -37,35 +38,55 @@ SERVICE_DATA_ATTRIBUTES = [
     'tls.notAfter'
 ]
 
+# when SERVICE_DATA_ATTRIBUTES is empty, drop service_data keys found in fewer than this fraction of services
+# e.g. 0.01 prunes keys present on less than 1% of rows; 0 keeps every key
+SERVICE_DATA_KEY_FREQUENCY = 0
+
+# parse relevant attributes from a service record
+def parse_service(s):
+    row = {}
+    for a in ATTRIBUTES:
+        row[a] = s.get(a, '')
+
+    service_data = s.get('service_data', {})
+    if service_data:
+        if SERVICE_DATA_ATTRIBUTES:
+            for attrib in SERVICE_DATA_ATTRIBUTES:
+                row[attrib] = service_data.get(attrib, '')
+        else:
+            for attrib in service_data:
+                row[attrib] = service_data.get(attrib, '')
+
+    return row
+
 def main(): 
     # get services
+    # the response is streamed so services are parsed and written as they arrive
     url = f'{RUNZERO_BASE_URL}/export/org/services.json?_oid={RUNZERO_ORG_ID}&search={QUERY}'
-    header = {"Content-Type": "application/json", "Authorization": "Bearer " + RUNZERO_EXPORT_TOKEN}
-    services = requests.get(url, headers=header)
-    services_json = services.json()
-
-    output = []
-    for s in services_json:
-        row = {}
-        for a in ATTRIBUTES:
-            row[a] = s.get(a, '')
+    try:
+        with open_export(url, RUNZERO_EXPORT_TOKEN) as services:
+            rows = map(parse_service, iter_json_array(services))
 
-        service_data = s.get('service_data', {})
-        if service_data:
+            # export services to output file
             if SERVICE_DATA_ATTRIBUTES:
-                for attrib in SERVICE_DATA_ATTRIBUTES:
-                    row[attrib] = service_data.get(attrib, '')
+                row_count = 0
+                writer = open_writer(OUTPUT_FILE, OUTPUT_FORMAT, ATTRIBUTES + SERVICE_DATA_ATTRIBUTES)
+                try:
+                    for row in rows:
+                        writer.write(row)
+                        row_count += 1
+                finally:
+                    writer.close()
             else:
-                for attrib in service_data:
-                    row[attrib] = service_data.get(attrib, '')
-
-        output.append(row)
+                row_count, pruned = write_discovered_columns(rows, OUTPUT_FILE, OUTPUT_FORMAT, ATTRIBUTES, SERVICE_DATA_KEY_FREQUENCY)
+                if pruned:
+                    print('Pruned ' + str(len(pruned)) + ' rare service_data keys: ' + ', '.join(pruned))
+    except ExportError as e:
+        print(e)
+        exit(1)
 
-    # export services to csv file
-    with open(CSV_FILE, mode='w') as file:
-        writer = csv.DictWriter(file, fieldnames=output[0].keys())
-        writer.writeheader()
-        writer.writerows(output)
+    print(services.summary('services export'))
+    print(str(row_count) + ' services saved to ' + OUTPUT_FILE)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,9 +1,10 @@
 from dotenv import load_dotenv
 import os
-import requests
+import runzero_client
 import json
 import csv
 from datetime import datetime, date
+from org_fanout import for_each_org
 
 load_dotenv()
 RUNZERO_CLIENT_ID = os.getenv("RUNZERO_CLIENT_ID")
@@ -12,20 +13,15 @@ RUNZERO_BASE_URL = 'https://console.runzero.com/api/v1.0'
 
 # Authentication with client ID and secret and obtain bearer token
 def get_token():
-    token_request_url = f'{RUNZERO_BASE_URL}/account/api/token'
-    token_request_header = {"Content-Type": "application/x-www-form-urlencoded"}
-    token_request_data = {"grant_type": "client_credentials"}
-    token_response = requests.post(token_request_url, data=token_request_data, headers=token_request_header, verify=True, auth=(RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET))
-    if token_response.status_code != 200:
-        print("Failed to obtain token from OAuth server.")
+    try:
+        return runzero_client.get_token(RUNZERO_BASE_URL, RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET)
+    except runzero_client.TokenError as e:
+        print(e)
         exit(1)
-    else:
-        token_json = json.loads(token_response.text)
-        return token_json['access_token']    
 
 # Get all organization within defined account
 def get_organizations(token):
-    orgs = requests.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    orgs = runzero_client.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if orgs.status_code != 200:
         print("Failed to retrieve organization data.")
         exit(1)
@@ -33,7 +29,7 @@ def get_organizations(token):
 
 # Get all explorers within specified organization
 def get_explorers(token, org_id):
-    explorers = requests.get(f'{RUNZERO_BASE_URL}/org/explorers?_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    explorers = runzero_client.get(f'{RUNZERO_BASE_URL}/org/explorers?_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if explorers.status_code != 200:
         print("Failed to retrieve explorer data.")
         exit(1)
@@ -41,7 +37,7 @@ def get_explorers(token, org_id):
 
 # Determine whether an explorer has passive sampling enabled
 def check_passive(token, agent_id):
-    tasks = requests.get(f'{RUNZERO_BASE_URL}/account/tasks?search=agent_id%3A{agent_id}%20and%20type%3Asample', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    tasks = runzero_client.get(f'{RUNZERO_BASE_URL}/account/tasks?search=agent_id%3A{agent_id}%20and%20type%3Asample', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     
     if tasks.status_code != 200:
         print('Failed to retrieve task data and confirm whether passive sampling is configure on explorer ' + agent_id + '.')
@@ -52,6 +48,11 @@ def check_passive(token, agent_id):
     else:
         return True
 
+# Get the explorers of an organization together with whether each has passive sampling enabled
+def get_org_explorers(token, org_id):
+    explorers_json = get_explorers(token, org_id).json()
+    return [(item, check_passive(token, item.get('id', ''))) for item in explorers_json]
+
 # Output final results to a csv file
 def write_to_csv(output: list, filename: str, fieldnames: list):
     file = open(filename, "w")
@@ -85,18 +86,15 @@ def main():
         "mem_usedPercent"
     ]
 
-    for o in orgs:
-        org_id = o.get('id', '')
-        org_name = o.get('name', '')
+    # Fetch explorers and check passive sampling for several organizations at a time
+    explorers_by_org = for_each_org(orgs, lambda o: get_org_explorers(access_token, o.get('id', '')))
 
-        explorers = (get_explorers(access_token, org_id))
-        explorers_json = explorers.json()      
+    for o, explorers in zip(orgs, explorers_by_org):
+        org_name = o.get('name', '')
 
-        for item in explorers_json:
+        for item, passive in explorers:
 
-            # Check if passive sampling is configured for explorer
             explorer_id = item.get('id', '')
-            passive = check_passive(access_token, explorer_id)
 
             # Append explorer details to output file
             explorers_output.append({
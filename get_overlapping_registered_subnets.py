@@ -1,13 +1,23 @@
 from dotenv import load_dotenv
 import os
-import requests
-import ipaddress
-from itertools import combinations
+import sys
+import csv
+import runzero_client
+from ip_ranges import AddressIndex, find_overlapping_ranges, normalize_scope
+from org_fanout import for_each_org
 
 load_dotenv()
 RUNZERO_BASE_URL = 'https://console.runzero.com/api/v1.0'
 RUNZERO_ORG_TOKEN = os.getenv('RUNZERO_ORG_TOKEN')
 RUNZERO_ORG_ID = os.getenv('RUNZERO_ORG_ID')
+RUNZERO_CLIENT_ID = os.getenv('RUNZERO_CLIENT_ID')
+RUNZERO_CLIENT_SECRET = os.getenv('RUNZERO_CLIENT_SECRET')
+
+# Run with --account to compare the registered subnets of every organization in the account instead of only
+# RUNZERO_ORG_ID; uses RUNZERO_CLIENT_ID and RUNZERO_CLIENT_SECRET and writes the overlaps to OUTPUT_FILE
+# grouped by organization pair
+ACCOUNT = '--account' in sys.argv
+OUTPUT_FILE = 'get_overlapping_registered_subnets_output.csv'
 
 SITES_TO_IGNORE = [
     'Excluded Site 1',
@@ -15,52 +25,147 @@ SITES_TO_IGNORE = [
     'Excluded Site 3'
 ]
 
+# Registered subnets inside any of these prefixes are ignored, e.g. 192.168.0.0/16 also ignores 192.168.1.0/24
+# Addresses and start-end ranges are accepted as well
 SUBNETS_TO_IGNORE = [
-    ipaddress.ip_network('192.168.1.0/24')
+    '192.168.1.0/24'
 ]
+IGNORED_SUBNETS = AddressIndex(SUBNETS_TO_IGNORE)
+
+# Authentication with client ID and secret and obtain bearer token
+def get_token():
+    try:
+        return runzero_client.get_token(RUNZERO_BASE_URL, RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET)
+    except runzero_client.TokenError as e:
+        print(e)
+        exit(1)
+
+# Get all organization within defined account
+def get_organizations(token):
+    orgs = runzero_client.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    if orgs.status_code != 200:
+        print('Failed to retrieve organization data. ', orgs.status_code)
+        exit(1)
+    return orgs.json()
 
 # Get all sites within specified organization
 def get_sites(token, org_id):
-    sites = requests.get(f'{RUNZERO_BASE_URL}/org/sites?_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    sites = runzero_client.get(f'{RUNZERO_BASE_URL}/org/sites?_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if sites.status_code != 200:
-        print('Failed to retrieve site data. ', sites.status_code)
+        print(f'Failed to retrieve site data for org {org_id}. ', sites.status_code)
         exit(1)
     return sites.json()
 
-# Parse registered subnets
-def parse_subnets(site):
+# List registered subnets; each subnet is returned as (subnet, site id, site name, org id, org name)
+def parse_subnets(site, org_id='', org_name=''):
     subnets = site.get('subnets', {})
-    out = []
-    for key in subnets.keys():
-        net = ipaddress.ip_network(key)
-        if net not in SUBNETS_TO_IGNORE:
-            out.append((net, site['id'], site['name']))
-    return out
-
-# Find overlaps in registered subnets
+    return [(key, site['id'], site['name'], org_id, org_name) for key in subnets.keys()]
+
+# Parse the registered subnets of all sites that are not ignored
+def collect_subnets(sites, org_id='', org_name=''):
+    subnets = []
+    for site in sites:
+        if site.get('name') not in SITES_TO_IGNORE:
+            subnets += parse_subnets(site, org_id, org_name)
+    return subnets
+
+# Find overlaps in registered subnets of different sites
+# relationship is 'equal' when both sites register the same subnet, 'contains' when subnet1 contains subnet2
+# and 'overlap' for a partial overlap. Subnets inside SUBNETS_TO_IGNORE are skipped and subnets that cannot be
+# parsed are reported.
 def find_overlaps(subnet_list):
+    table = normalize_scope([s[0] for s in subnet_list])
+    for source, text in table.hostnames + table.invalid:
+        print(f'Skipping registered subnet {text} of site {subnet_list[source][2]}: not an IP address, CIDR or range.')
+
+    ranges = []
+    subnets = []
+    for r, source in zip(table.ranges(), table.range_sources()):
+        if not IGNORED_SUBNETS.covers(*r):
+            ranges.append(r)
+            subnets.append(source)
+
     overlaps = []
-    for (net1, sid1, name1), (net2, sid2, name2) in combinations(subnet_list, 2):
-        if sid1 != sid2 and net1.overlaps(net2):
-            overlaps.append({'site1_id': sid1, 'site1_name': name1, 'subnet1': str(net1), 'site2_id': sid2, 'site2_name': name2, 'subnet2': str(net2)})
+    for i, j, relationship in find_overlapping_ranges(ranges):
+        subnet1, sid1, name1, oid1, oname1 = subnet_list[subnets[i]]
+        subnet2, sid2, name2, oid2, oname2 = subnet_list[subnets[j]]
+        if sid1 != sid2:
+            overlaps.append({
+                'org1_id': oid1, 'org1_name': oname1, 'site1_id': sid1, 'site1_name': name1, 'subnet1': subnet1,
+                'org2_id': oid2, 'org2_name': oname2, 'site2_id': sid2, 'site2_name': name2, 'subnet2': subnet2,
+                'relationship': relationship
+            })
     return overlaps
 
+# Put the two sides of every overlap in organization name order and sort the overlaps by organization pair
+# so that overlaps between the same two organizations are listed together; when the sides are swapped a
+# 'contains' relationship becomes 'contained_by'
+def group_by_org_pair(overlaps):
+    swapped = {'equal': 'equal', 'contains': 'contained_by', 'overlap': 'overlap'}
+    grouped = []
+    for o in overlaps:
+        if (o['org1_name'], o['org1_id']) > (o['org2_name'], o['org2_id']):
+            o = {
+                'org1_id': o['org2_id'], 'org1_name': o['org2_name'], 'site1_id': o['site2_id'], 'site1_name': o['site2_name'], 'subnet1': o['subnet2'],
+                'org2_id': o['org1_id'], 'org2_name': o['org1_name'], 'site2_id': o['site1_id'], 'site2_name': o['site1_name'], 'subnet2': o['subnet1'],
+                'relationship': swapped[o['relationship']]
+            }
+        grouped.append(o)
+    grouped.sort(key=lambda o: (o['org1_name'], o['org1_id'], o['org2_name'], o['org2_id'], o['site1_name'], o['subnet1']))
+    return grouped
+
+# Output final results to a csv file
+def write_to_csv(output: list, filename: str, fieldnames: list):
+    file = open(filename, "w")
+    writer = csv.DictWriter(file, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(output)
+    file.close()
+
+# Compare the registered subnets of every organization in the account
+def account_overlaps():
+    token = get_token()
+    orgs = get_organizations(token)
+
+    # Fetch sites for several organizations at a time and feed every subnet into one search
+    subnets_by_org = for_each_org(orgs, lambda o: collect_subnets(get_sites(token, o.get('id', '')), o.get('id', ''), o.get('name', '')))
+    subnets = [s for org_subnets in subnets_by_org for s in org_subnets]
+
+    overlaps = group_by_org_pair(find_overlaps(subnets))
+    fields = [
+        'org1_id', 'org1_name', 'org2_id', 'org2_name', 'relationship',
+        'site1_id', 'site1_name', 'subnet1', 'site2_id', 'site2_name', 'subnet2'
+    ]
+    write_to_csv(output=overlaps, filename=OUTPUT_FILE, fieldnames=fields)
+
+    pairs = {}
+    for o in overlaps:
+        key = (o['org1_name'], o['org2_name'])
+        pairs[key] = pairs.get(key, 0) + 1
+    print(f'{len(subnets)} registered subnets in {len(orgs)} organizations, {len(overlaps)} overlaps written to {OUTPUT_FILE}')
+    for (org1, org2), count in pairs.items():
+        print(f'{org1} / {org2}: {count}')
+
 def main():
+    if ACCOUNT:
+        account_overlaps()
+        return
+
     sites = get_sites(RUNZERO_ORG_TOKEN, RUNZERO_ORG_ID)
-    subnets = []
-    for site in sites:
-        site_name = site.get('name')
-        if site_name not in SITES_TO_IGNORE:
-            subnets += parse_subnets(site)
+    subnets = collect_subnets(sites, RUNZERO_ORG_ID)
 
     overlaps = find_overlaps(subnets)
 
     if not overlaps:
         print('No overlapping registered subnets found in this organization.')
     else:
-        print('Overlapping subnets found:')
-        for o in overlaps:
-            print(f'Site {o["site1_name"]} ({o["site1_id"]}) subnet {o["subnet1"]} overlaps with site {o["site2_name"]} ({o["site2_id"]}) subnet {o["subnet2"]}')
+        descriptions = {'equal': 'is also registered by', 'contains': 'contains', 'overlap': 'partially overlaps'}
+        for relationship, title in (('equal', 'Subnets registered by more than one site:'), ('contains', 'Subnets contained in another site\'s subnet:'), ('overlap', 'Partially overlapping subnets:')):
+            found = [o for o in overlaps if o['relationship'] == relationship]
+            if found:
+                print(title)
+                for o in found:
+                    print(f'Site {o["site1_name"]} ({o["site1_id"]}) subnet {o["subnet1"]} {descriptions[relationship]} site {o["site2_name"]} ({o["site2_id"]}) subnet {o["subnet2"]}')
 
 if __name__ == '__main__':
     main()
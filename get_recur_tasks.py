@@ -1,10 +1,11 @@
 from dotenv import load_dotenv
 import os
-import requests
+import runzero_client
 import json
 import csv
 from datetime import datetime, date
 from urllib.parse import quote
+from org_fanout import for_each_org
 
 load_dotenv()
 RUNZERO_CLIENT_ID = os.getenv("RUNZERO_CLIENT_ID")
@@ -13,20 +14,15 @@ RUNZERO_BASE_URL = 'https://console.runzero.com/api/v1.0'
 
 # Authentication with client ID and secret and obtain bearer token
 def get_token():
-    token_request_url = f'{RUNZERO_BASE_URL}/account/api/token'
-    token_request_header = {"Content-Type": "application/x-www-form-urlencoded"}
-    token_request_data = {"grant_type": "client_credentials"}
-    token_response = requests.post(token_request_url, data=token_request_data, headers=token_request_header, verify=True, auth=(RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET))
-    if token_response.status_code != 200:
-        print("Failed to obtain token from OAuth server.")
+    try:
+        return runzero_client.get_token(RUNZERO_BASE_URL, RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET)
+    except runzero_client.TokenError as e:
+        print(e)
         exit(1)
-    else:
-        token_json = json.loads(token_response.text)
-        return token_json['access_token']    
 
 # Get client id
 def get_client_id(token):
-    account = requests.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    account = runzero_client.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if account.status_code != 200:
         print("Failed to retrieve account information.")
         exit(1)
@@ -35,7 +31,7 @@ def get_client_id(token):
 
 # Get all organization within defined account
 def get_organizations(token):
-    orgs = requests.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    orgs = runzero_client.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if orgs.status_code != 200:
         print("Failed to retrieve organization data.")
         exit(1)
@@ -44,7 +40,7 @@ def get_organizations(token):
 # Get all tasks within specified organization
 def get_recurring_tasks(token, org_id):
     search = quote('recur:=true')
-    tasks = requests.get(f'{RUNZERO_BASE_URL}/org/tasks?search={search}&_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    tasks = runzero_client.get(f'{RUNZERO_BASE_URL}/org/tasks?search={search}&_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if tasks.status_code != 200:
         print("Failed to retrieve task data.")
         exit(1)
@@ -96,13 +92,13 @@ def main():
     access_token = get_token()
     orgs = get_organizations(access_token)
 
-    for o in orgs:
+    # Fetch tasks for several organizations at a time; results come back in organization order
+    tasks_by_org = for_each_org(orgs, lambda o: get_recurring_tasks(access_token, o.get('id', '')).json())
+
+    for o, recur_tasks_json in zip(orgs, tasks_by_org):
         org_id = o.get('id', '')
         org_name = o.get('name', '')
 
-        recur_tasks = get_recurring_tasks(access_token, org_id)
-        recur_tasks_json = recur_tasks.json()      
-
         for item in recur_tasks_json:
             recur_tasks_output.append({
                 'organization_name':org_name,
@@ -1,8 +1,9 @@
 from dotenv import load_dotenv
 import os
-import requests
+import runzero_client
 import json
 import csv
+from org_fanout import for_each_org
 
 load_dotenv()
 RUNZERO_CLIENT_ID = os.getenv("RUNZERO_CLIENT_ID")
@@ -11,20 +12,15 @@ RUNZERO_BASE_URL = 'https://console.runzero.com/api/v1.0'
 
 # Authentication with client ID and secret and obtain bearer token
 def get_token():
-    token_request_url = f'{RUNZERO_BASE_URL}/account/api/token'
-    token_request_header = {"Content-Type": "application/x-www-form-urlencoded"}
-    token_request_data = {"grant_type": "client_credentials"}
-    token_response = requests.post(token_request_url, data=token_request_data, headers=token_request_header, verify=True, auth=(RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET))
-    if token_response.status_code != 200:
-        print("Failed to obtain token from OAuth server.")
+    try:
+        return runzero_client.get_token(RUNZERO_BASE_URL, RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET)
+    except runzero_client.TokenError as e:
+        print(e)
         exit(1)
-    else:
-        token_json = json.loads(token_response.text)
-        return token_json['access_token']    
 
 # Get all organization within defined account
 def get_organizations(token):
-    orgs = requests.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    orgs = runzero_client.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if orgs.status_code != 200:
         print("Failed to retrieve organization data.")
         exit(1)
@@ -32,7 +28,7 @@ def get_organizations(token):
 
 # Get all sites for the specified organization
 def get_sites(token, org_id):
-    sites = requests.get(f'{RUNZERO_BASE_URL}/org/sites?_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    sites = runzero_client.get(f'{RUNZERO_BASE_URL}/org/sites?_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if sites.status_code != 200:
         print("Failed to retrieve site data for org {org_id}.")
         exit(1)
@@ -61,11 +57,12 @@ def main():
         'tags'
     ]
 
-    for o in orgs:
+    # Fetch sites for several organizations at a time; results come back in organization order
+    sites_by_org = for_each_org(orgs, lambda o: get_sites(access_token, o.get('id', '')))
+
+    for o, sites in zip(orgs, sites_by_org):
         org_id = o.get('id', '')
         org_name = o.get('name', '')
-        
-        sites = get_sites(access_token, org_id)
 
         for s in sites:
             site_id = s.get('id', '')
@@ -1,12 +1,17 @@
 from dotenv import load_dotenv
 import os
-import requests
+import sys
 import json
 import csv
 from datetime import datetime, date
 from typing import Any, Dict, List
 from urllib.parse import quote
 
+# Shared helpers live in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import runzero_client
+from org_fanout import for_each_org
+
 load_dotenv()
 RUNZERO_BASE_URL = os.getenv("RUNZERO_BASE_URL")
 RUNZERO_CLIENT_ID = os.getenv("RUNZERO_CLIENT_ID")
@@ -14,20 +19,15 @@ RUNZERO_CLIENT_SECRET = os.getenv("RUNZERO_CLIENT_SECRET")
 
 # Authentication with client ID and secret and obtain bearer token
 def get_token():
-    token_request_url = f'{RUNZERO_BASE_URL}/account/api/token'
-    token_request_header = {"Content-Type": "application/x-www-form-urlencoded"}
-    token_request_data = {"grant_type": "client_credentials"}
-    token_response = requests.post(token_request_url, data=token_request_data, headers=token_request_header, verify=True, auth=(RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET))
-    if token_response.status_code != 200:
-        print("Failed to obtain token from OAuth server.")
+    try:
+        return runzero_client.get_token(RUNZERO_BASE_URL, RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET)
+    except runzero_client.TokenError as e:
+        print(e)
         exit(1)
-    else:
-        token_json = json.loads(token_response.text)
-        return token_json['access_token']    
 
 # Get client-id
 def get_client_id(token):
-    account = requests.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    account = runzero_client.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if account.status_code != 200:
         print("Failed to retrieve account information.")
         exit(1)
@@ -36,7 +36,7 @@ def get_client_id(token):
 
 # Get all organization within defined account
 def get_organizations(token):
-    orgs = requests.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    orgs = runzero_client.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if orgs.status_code != 200:
         print("Failed to retrieve organization data.")
         exit(1)
@@ -44,7 +44,7 @@ def get_organizations(token):
 
 # Get all explorers within specified organization
 def get_explorers(token, org_id):
-    explorers = requests.get(f'{RUNZERO_BASE_URL}/org/explorers?_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    explorers = runzero_client.get(f'{RUNZERO_BASE_URL}/org/explorers?_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if explorers.status_code != 200:
         print("Failed to retrieve explorer data.")
         exit(1)
@@ -52,7 +52,7 @@ def get_explorers(token, org_id):
 
 # Get latest explorer version
 def get_explorer_version():
-    metadata = requests.get('https://console.runzero.com/api/v1.0/metadata')
+    metadata = runzero_client.get('https://console.runzero.com/api/v1.0/metadata')
     if metadata.status_code != 200:
         print("Unable to retrieve console metadata from https://console.runzero.com/api/v1.0/metadata.")
         exit(1)
@@ -62,7 +62,7 @@ def get_explorer_version():
 
 # Determine whether an explorer has passive sampling enabled
 def check_passive(token, agent_id):
-    tasks = requests.get(f'{RUNZERO_BASE_URL}/account/tasks?search=agent_id%3A{agent_id}%20and%20type%3Asample', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    tasks = runzero_client.get(f'{RUNZERO_BASE_URL}/account/tasks?search=agent_id%3A{agent_id}%20and%20type%3Asample', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     
     if tasks.status_code != 200:
         print('Failed to retrieve task data and confirm whether passive sampling is configure on explorer ' + agent_id + '.')
@@ -75,6 +75,11 @@ def check_passive(token, agent_id):
     else:
         return True
 
+# Get the explorers of an organization together with whether each has passive sampling enabled
+def get_org_explorers(token, org_id):
+    explorers_json = get_explorers(token, org_id).json()
+    return [(item, check_passive(token, item.get('id', ''))) for item in explorers_json]
+
 # Output final results to a csv file
 def write_to_csv(output: list, filename: str, fieldnames: list):
     file = open(filename, "w")
@@ -125,6 +130,10 @@ def explorers_healthcheck():
         "mem_usedPercent"
     ]
 
+    # Fetch explorers and check passive sampling for several organizations at a time
+    live_orgs = [o for o in orgs if not o.get('demo', '')]
+    explorers_by_org = dict(zip([o.get('id', '') for o in live_orgs], for_each_org(live_orgs, lambda o: get_org_explorers(access_token, o.get('id', '')))))
+
     for o in orgs:
         demo = o.get('demo', '')
         if not demo:
@@ -132,10 +141,7 @@ def explorers_healthcheck():
             org_id = o.get('id', '')
             org_name = o.get('name', '')
 
-            explorers = (get_explorers(access_token, org_id))
-            explorers_json = explorers.json()      
-
-            for item in explorers_json:
+            for item, passive in explorers_by_org[org_id]:
 
                 # Calculate explorer metrics
                 metric_explorer_count += 1
@@ -156,9 +162,7 @@ def explorers_healthcheck():
                 if item.get('system_info', {}).get('mem', {}).get('total', '') < recommended_explorer_memory_bytes:
                     metric_memory_allocation += 1
 
-                # Check if passive sampling is configured for explorer
                 explorer_id = item.get('id', '')
-                passive = check_passive(access_token, explorer_id)
                 if passive:
                     metric_passive_sampling += 1
 
@@ -1,12 +1,18 @@
 from dotenv import load_dotenv
 import os
-import requests
+import sys
 import json
 import csv
 from datetime import datetime, date
 from typing import Any, Dict, List
 from urllib.parse import quote
 
+# Shared helpers live in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import runzero_client
+from runzero_export import ExportError, open_export
+from org_fanout import for_each_org
+
 load_dotenv()
 RUNZERO_BASE_URL = os.getenv("RUNZERO_BASE_URL")
 RUNZERO_CLIENT_ID = os.getenv("RUNZERO_CLIENT_ID")
@@ -14,20 +20,15 @@ RUNZERO_CLIENT_SECRET = os.getenv("RUNZERO_CLIENT_SECRET")
 
 # Authentication with client ID and secret and obtain bearer token
 def get_token():
-    token_request_url = f'{RUNZERO_BASE_URL}/account/api/token'
-    token_request_header = {"Content-Type": "application/x-www-form-urlencoded"}
-    token_request_data = {"grant_type": "client_credentials"}
-    token_response = requests.post(token_request_url, data=token_request_data, headers=token_request_header, verify=True, auth=(RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET))
-    if token_response.status_code != 200:
-        print("Failed to obtain token from OAuth server.")
+    try:
+        return runzero_client.get_token(RUNZERO_BASE_URL, RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET)
+    except runzero_client.TokenError as e:
+        print(e)
         exit(1)
-    else:
-        token_json = json.loads(token_response.text)
-        return token_json['access_token']    
 
 # Get client id
 def get_client_id(token):
-    account = requests.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    account = runzero_client.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if account.status_code != 200:
         print("Failed to retrieve account information.")
         exit(1)
@@ -36,25 +37,38 @@ def get_client_id(token):
 
 # Get all organization within defined account
 def get_organizations(token):
-    orgs = requests.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    orgs = runzero_client.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if orgs.status_code != 200:
         print("Failed to retrieve organization data.")
         exit(1)
     return json.loads(orgs.text)
 
 def get_sites(token, org_id):
-    sites = requests.get(f'{RUNZERO_BASE_URL}/org/sites?_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    sites = runzero_client.get(f'{RUNZERO_BASE_URL}/org/sites?_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if sites.status_code != 200:
         print("Failed to retrieve site data.")
         exit(1)
     return sites
 
-def export_sites(token, org_id):
-    export = requests.get(f'{RUNZERO_BASE_URL}/export/org/sites.csv?_oid={org_id}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
-    if export.status_code != 200:
+# Download the site export csv to a file, decompressing it as it streams in
+def export_sites(token, org_id, filename):
+    try:
+        with open_export(f'{RUNZERO_BASE_URL}/export/org/sites.csv?_oid={org_id}', token) as export:
+            with open(filename, 'wb') as f:
+                for chunk in export.iter_content():
+                    f.write(chunk)
+    except ExportError:
         print("Failed to retrieve site export csv.")
         exit(1)
-    return export
+    print(export.summary('sites export'))
+
+# Export the sites csv of an organization and return its site data
+def collect_org_sites(token, o, data_directory):
+    org_id = o.get('id', '')
+    org_name = o.get('name', '')
+    sites_export_file_path = data_directory + '/sites_' + org_id + '_' + org_name + '.csv'
+    export_sites(token, org_id, sites_export_file_path)
+    return get_sites(token, org_id).json()
 
 # Output final results to a csv file
 def write_to_csv(output: list, filename: str, fieldnames: list):
@@ -85,6 +99,10 @@ def sites_healthcheck():
 
     metrics_output_file = DATA_DIRECTORY + '/metrics.txt'
 
+    # Export sites csv and collect site data for several organizations at a time
+    live_orgs = [o for o in orgs if not o.get('demo', '')]
+    sites_by_org = dict(zip([o.get('id', '') for o in live_orgs], for_each_org(live_orgs, lambda o: collect_org_sites(access_token, o, DATA_DIRECTORY))))
+
     with open(metrics_output_file, 'a') as f:
         f.write('site metrics\n')
         for o in orgs:
@@ -94,16 +112,9 @@ def sites_healthcheck():
                 metric_org_count += 1
                 org_id = o.get('id', '')
                 org_name = o.get('name', '')
-    
-                # Export sites csv
-                sites_export_file_path = DATA_DIRECTORY + '/sites_' + org_id + '_' + org_name + '.csv'
-                sites_csv = export_sites(access_token, org_id)
-                with open(sites_export_file_path, 'wb') as csv:
-                    csv.write(sites_csv.content)
 
                 # Collect site metrics
-                sites = get_sites(access_token, org_id)
-                sites_json = sites.json()      
+                sites_json = sites_by_org[org_id]
 
                 for item in sites_json:
                     metric_site_count += 1
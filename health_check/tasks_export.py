@@ -1,13 +1,16 @@
 from dotenv import load_dotenv
 import os
-import requests
-import json
+import sys
 import csv
 import textwrap
 from datetime import datetime, date
 from typing import Any, Dict, List
 from urllib.parse import quote
 
+# Shared helpers live in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import runzero_client
+
 load_dotenv()
 RUNZERO_BASE_URL = os.getenv("RUNZERO_BASE_URL")
 RUNZERO_CLIENT_ID = os.getenv("RUNZERO_CLIENT_ID")
@@ -15,20 +18,15 @@ RUNZERO_CLIENT_SECRET = os.getenv("RUNZERO_CLIENT_SECRET")
 
 # Authentication with client ID and secret and obtain bearer token
 def get_token():
-    token_request_url = f'{RUNZERO_BASE_URL}/account/api/token'
-    token_request_header = {"Content-Type": "application/x-www-form-urlencoded"}
-    token_request_data = {"grant_type": "client_credentials"}
-    token_response = requests.post(token_request_url, data=token_request_data, headers=token_request_header, verify=True, auth=(RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET))
-    if token_response.status_code != 200:
-        print("Failed to obtain token from OAuth server.")
+    try:
+        return runzero_client.get_token(RUNZERO_BASE_URL, RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET)
+    except runzero_client.TokenError as e:
+        print(e)
         exit(1)
-    else:
-        token_json = json.loads(token_response.text)
-        return token_json['access_token']    
 
 # Get templates
 def get_templates(token):
-    templates = requests.get(f'{RUNZERO_BASE_URL}/account/tasks/templates', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    templates = runzero_client.get(f'{RUNZERO_BASE_URL}/account/tasks/templates', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if templates.status_code != 200:
         print("Failed to retrieve task templates.")
         exit(1)
@@ -36,7 +34,7 @@ def get_templates(token):
 
 # Get client id
 def get_client_id(token):
-    account = requests.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    account = runzero_client.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if account.status_code != 200:
         print("Failed to retrieve account information.")
         exit(1)
@@ -45,7 +43,7 @@ def get_client_id(token):
 
 def get_task_output(token, task_type, recurring):
     search = quote('type:=' + task_type + ' and recur:=' + recurring)    
-    tasks = requests.get(f'{RUNZERO_BASE_URL}/account/tasks?search={search}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    tasks = runzero_client.get(f'{RUNZERO_BASE_URL}/account/tasks?search={search}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if tasks.status_code != 200:
         print("Failed to retrieve task data.")
         exit(1)
@@ -1,13 +1,17 @@
 from dotenv import load_dotenv
 import os
-import requests
-import json
+import sys
 import csv
 import textwrap
 from datetime import datetime, date
 from typing import Any, Dict, List
 from urllib.parse import quote
 
+# Shared helpers live in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import runzero_client
+from org_fanout import parallel_map
+
 load_dotenv()
 RUNZERO_BASE_URL = os.getenv("RUNZERO_BASE_URL")
 RUNZERO_CLIENT_ID = os.getenv("RUNZERO_CLIENT_ID")
@@ -15,20 +19,15 @@ RUNZERO_CLIENT_SECRET = os.getenv("RUNZERO_CLIENT_SECRET")
 
 # Authentication with client ID and secret and obtain bearer token
 def get_token():
-    token_request_url = f'{RUNZERO_BASE_URL}/account/api/token'
-    token_request_header = {"Content-Type": "application/x-www-form-urlencoded"}
-    token_request_data = {"grant_type": "client_credentials"}
-    token_response = requests.post(token_request_url, data=token_request_data, headers=token_request_header, verify=True, auth=(RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET))
-    if token_response.status_code != 200:
-        print("Failed to obtain token from OAuth server.")
+    try:
+        return runzero_client.get_token(RUNZERO_BASE_URL, RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET)
+    except runzero_client.TokenError as e:
+        print(e)
         exit(1)
-    else:
-        token_json = json.loads(token_response.text)
-        return token_json['access_token']    
 
 # Get templates
 def get_templates(token):
-    templates = requests.get(f'{RUNZERO_BASE_URL}/account/tasks/templates', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    templates = runzero_client.get(f'{RUNZERO_BASE_URL}/account/tasks/templates', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if templates.status_code != 200:
         print("Failed to retrieve task templates.")
         exit(1)
@@ -36,7 +35,7 @@ def get_templates(token):
 
 # Get client id
 def get_client_id(token):
-    account = requests.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    account = runzero_client.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     if account.status_code != 200:
         print("Failed to retrieve account information.")
         exit(1)
@@ -46,10 +45,10 @@ def get_client_id(token):
 def get_tasks(token, type=None):
     if type == 'recurring':
         search = quote('recur:=true')
-        tasks = requests.get(f'{RUNZERO_BASE_URL}/account/tasks?search={search}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+        tasks = runzero_client.get(f'{RUNZERO_BASE_URL}/account/tasks?search={search}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
     else:
         search = quote('created_at:<90days and not type:analysis and recur:=false')
-        tasks = requests.get(f'{RUNZERO_BASE_URL}/account/tasks?search={search}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+        tasks = runzero_client.get(f'{RUNZERO_BASE_URL}/account/tasks?search={search}', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
 
     if tasks.status_code != 200:
         print("Failed to retrieve task data.")
@@ -158,17 +157,23 @@ def tasks_healthcheck():
     ]    
 
     access_token = get_token()
-    client_id = get_client_id(access_token)    
+
+    # Tasks are listed account wide, so instead of one call per organization the independent account
+    # requests are made at the same time
+    client_id, templates, tasks, recur_tasks = parallel_map(lambda fetch: fetch(), [
+        lambda: get_client_id(access_token),
+        lambda: get_templates(access_token),
+        lambda: get_tasks(access_token),
+        lambda: get_tasks(access_token, 'recurring')
+    ])
 
     # Gather metrics on task templates
-    templates = get_templates(access_token)
     templates_json = templates.json()
 
     for item in templates_json:
         metric_templates += 1
 
     # Gather metrics and produce output file for executed tasks
-    tasks = get_tasks(access_token)
     tasks_json = tasks.json()   
 
     for item in tasks_json:
@@ -259,7 +264,6 @@ def tasks_healthcheck():
         })
 
     # Gather metrics and produce output file for recurring tasks
-    recur_tasks = get_tasks(access_token, 'recurring')
     recur_tasks_json = recur_tasks.json()
     
     for item in recur_tasks_json:
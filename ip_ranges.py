@@ -0,0 +1,454 @@
+# ip_ranges.py
+#
+# Shared helpers for working with IP addresses, CIDRs and address ranges.
+#
+# Addresses are handled as (version, integer) pairs and ranges as inclusive (version, start, end) integer
+# triples so they can be compared, sorted and searched without creating ipaddress objects for every value.
+# AddressIndex answers "is this address in the list" for lists that mix single addresses, CIDRs and ranges.
+# normalize_scope turns scope text (addresses, CIDRs, ranges, comma separated lists and hostnames) into a
+# ScopeTable of integer start/end columns; scope_digest and diff_scopes compare two of them by the
+# addresses they cover rather than by how they are written.
+
+import bisect
+import hashlib
+import heapq
+import ipaddress
+import re
+import socket
+from array import array
+
+# IPv4 hostmask for every prefix length, keyed by the prefix as written
+IPV4_HOSTMASKS = {str(p): (1 << (32 - p)) - 1 for p in range(33)}
+HOSTNAME = re.compile(r'(?=.*[a-z])(?=.{1,253}$)([a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9])?\.)*[a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9])?\.?$', re.IGNORECASE)
+
+# parse an address into its canonical string form, or None if it is not an IP address
+# zone ids (fe80::1%eth0) are dropped and IPv4-mapped IPv6 addresses are returned as IPv4
+def canonical_address(text):
+    ip = parse_address(text)
+    return str(ip) if ip is not None else None
+
+def parse_address(text):
+    text = text.strip().split('%', 1)[0]
+    try:
+        ip = ipaddress.ip_address(text)
+    except ValueError:
+        return None
+    if ip.version == 6 and ip.ipv4_mapped:
+        return ip.ipv4_mapped
+    return ip
+
+# convert a dotted quad IPv4 address into an integer without creating an ipaddress object
+# returns None for anything that is not a plain canonical dotted quad, such as IPv6 or zero padded octets
+def ipv4_to_int(text):
+    parts = text.split('.')
+    if len(parts) != 4:
+        return None
+    value = 0
+    for p in parts:
+        if not p.isdigit() or len(p) > 3 or (len(p) > 1 and p[0] == '0'):
+            return None
+        octet = int(p)
+        if octet > 255:
+            return None
+        value = value << 8 | octet
+    return value
+
+# convert an integer back into an address of the given version
+def int_to_address(version, value):
+    return ipaddress.IPv4Address(value) if version == 4 else ipaddress.IPv6Address(value)
+
+# parse a single address, a CIDR or a start-end range into an inclusive (version, start, end) triple
+# returns None when the entry cannot be parsed
+def parse_range(text):
+    text = text.strip()
+    if '-' in text:
+        first, _, last = text.partition('-')
+        start = parse_address(first)
+        end = parse_address(last)
+        if start is None or end is None or start.version != end.version or int(start) > int(end):
+            return None
+        return start.version, int(start), int(end)
+    if '/' in text:
+        try:
+            network = ipaddress.ip_network(text, strict=False)
+        except ValueError:
+            return None
+        return network_to_range(network)
+    ip = parse_address(text)
+    if ip is None:
+        return None
+    return ip.version, int(ip), int(ip)
+
+# convert an ipaddress network into an inclusive (version, start, end) triple
+# the end is computed from the prefix length, which is much cheaper than network.broadcast_address
+def network_to_range(network):
+    start = int(network.network_address)
+    return network.version, start, start | ((1 << (network.max_prefixlen - network.prefixlen)) - 1)
+
+# merge overlapping and adjacent (start, end) ranges of one address family into sorted disjoint ranges
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+# split an inclusive range into the smallest list of CIDRs that covers exactly the same addresses; a single
+# address is written without a prefix
+def range_to_cidrs(version, start, end):
+    bits = 32 if version == 4 else 128
+    cidrs = []
+    while start <= end:
+        # the largest block that is aligned at start and does not run past end
+        size = min((start & -start).bit_length() - 1 if start else bits, (end - start + 1).bit_length() - 1)
+        if version == 4:
+            address = socket.inet_ntoa(start.to_bytes(4, 'big'))
+        else:
+            address = str(ipaddress.IPv6Address(start))
+        cidrs.append(address if size == 0 else f'{address}/{bits - size}')
+        start += 1 << size
+    return cidrs
+
+# remove the removed (start, end) ranges from ranges; both must be sorted disjoint ranges of one address family
+# as returned by merge_ranges, and the result is in the same form
+def subtract_ranges(ranges, removed):
+    out = []
+    i = 0
+    for start, end in ranges:
+        while i < len(removed) and removed[i][1] < start:
+            i += 1
+        j = i
+        while j < len(removed) and removed[j][0] <= end:
+            if removed[j][0] > start:
+                out.append((start, removed[j][0] - 1))
+            start = max(start, removed[j][1] + 1)
+            j += 1
+        if start <= end:
+            out.append((start, end))
+    return out
+
+# merge (version, start, end) ranges per address family and write them as the smallest list of CIDRs that
+# covers exactly the same addresses, IPv4 first; a single address is written without a prefix
+def aggregate_cidrs(ranges):
+    ranges = list(ranges)
+    cidrs = []
+    for version in (4, 6):
+        for start, end in merge_ranges((r[1], r[2]) for r in ranges if r[0] == version):
+            cidrs += range_to_cidrs(version, start, end)
+    return cidrs
+
+# find every pair of overlapping ranges with a sweep over the ranges sorted by start address
+# ranges is a list of (version, start, end) triples; returns (i, j, kind) tuples of indexes into ranges where
+# kind is 'equal', 'contains' (range i contains range j) or 'overlap' (the ranges partially overlap)
+# runs in O(n log n + k) for n ranges and k overlapping pairs: ranges that have ended are dropped from the
+# active set through a heap ordered by end address, so every active range compared with a new one overlaps it
+def find_overlapping_ranges(ranges):
+    pairs = []
+    keys = [(version, start, -end) for version, start, end in ranges]
+    order = sorted(range(len(ranges)), key=keys.__getitem__)
+    active = {}
+    ends = []
+    version = None
+    for j in order:
+        v, start, end = ranges[j]
+        if v != version:
+            active.clear()
+            ends = []
+            version = v
+        while ends and ends[0][0] < start:
+            active.pop(heapq.heappop(ends)[1], None)
+        for i, (i_start, i_end) in active.items():
+            if i_start == start and i_end == end:
+                pairs.append((i, j, 'equal'))
+            elif i_end >= end:
+                pairs.append((i, j, 'contains'))
+            else:
+                pairs.append((i, j, 'overlap'))
+        active[j] = (start, end)
+        heapq.heappush(ends, (end, j))
+    return pairs
+
+# lookup index for a list of addresses, CIDRs and ranges
+# single addresses are kept in a hash set of canonical strings; CIDRs and ranges are merged into sorted
+# disjoint intervals per address family and searched with bisect, so a lookup is O(log n) however much the
+# entries overlap. Addresses that fall in an interval are recorded and resolved to the entries that contain
+# them once, when not_found is called, so the entries that were never seen can be reported.
+class AddressIndex:
+    def __init__(self, entries=()):
+        self.addresses = {}     # canonical address -> texts of the entries that name it
+        self.ranges = {4: [], 6: []}
+        self.starts = {4: [], 6: []}
+        self.covered = {4: [], 6: []}       # intervals with adjacent ones joined, for covers
+        self.covered_starts = {4: [], 6: []}
+        self.range_entries = []     # (version, start, end, entry text)
+        self.found = set()
+        self.matched = {4: set(), 6: set()}     # addresses that fell inside a range interval
+        self.invalid = []
+        for entry in entries:
+            self.add(entry)
+        self.build()
+
+    def add(self, entry):
+        parsed = parse_range(entry)
+        if parsed is None:
+            self.invalid.append(entry)
+            return
+        version, start, end = parsed
+        if start == end:
+            self.addresses.setdefault(str(int_to_address(version, start)), []).append(entry)
+        else:
+            self.range_entries.append((version, start, end, entry))
+
+    # merge overlapping range entries into disjoint [start, end] intervals for match, and separately join
+    # adjacent intervals and single addresses for covers, so a subnet spanning two neighbouring entries counts
+    # as covered
+    def build(self):
+        singles = {4: [], 6: []}
+        for address in self.addresses:
+            ip = ipaddress.ip_address(address)
+            singles[ip.version].append([int(ip), int(ip)])
+        for version in (4, 6):
+            intervals = []
+            for start, end in sorted((e[1], e[2]) for e in self.range_entries if e[0] == version):
+                if intervals and start <= intervals[-1][1]:
+                    intervals[-1][1] = max(intervals[-1][1], end)
+                else:
+                    intervals.append([start, end])
+            self.ranges[version] = intervals
+            self.starts[version] = [i[0] for i in intervals]
+            self.covered[version] = merge_ranges(intervals + singles[version])
+            self.covered_starts[version] = [i[0] for i in self.covered[version]]
+
+    def __len__(self):
+        return sum(map(len, self.addresses.values())) + len(self.range_entries)
+
+    # return True if the address is in the index and mark the entries that contain it as found
+    # an address that matches a single address entry is still looked up in the CIDRs and ranges, so the ones that
+    # contain it are not reported by not_found
+    def match(self, address):
+        entries = self.addresses.get(address)
+        if entries is not None:
+            self.found.update(entries)
+            if not self.range_entries:
+                return True
+        elif not self.range_entries and ':' not in address:
+            # without CIDRs or ranges an IPv4 address can only match exactly
+            return False
+        matched = entries is not None
+
+        # canonical IPv4 addresses are converted directly; anything else goes through ipaddress and is
+        # looked up again in its canonical form
+        value = ipv4_to_int(address)
+        if value is not None:
+            version = 4
+        else:
+            ip = parse_address(address)
+            if ip is None:
+                return matched
+            canonical = str(ip)
+            if canonical != address:
+                entries = self.addresses.get(canonical)
+                if entries is not None:
+                    self.found.update(entries)
+                    matched = True
+            version = ip.version
+            value = int(ip)
+
+        intervals = self.ranges[version]
+        i = bisect.bisect_right(self.starts[version], value) - 1
+        if i < 0 or value > intervals[i][1]:
+            return matched
+        self.matched[version].add(value)
+        return True
+
+    # return True if every address from start to end is covered by the entries in the index, e.g. a subnet
+    # that lies inside an ignored prefix or spans several adjacent ones
+    def covers(self, version, start, end):
+        intervals = self.covered[version]
+        i = bisect.bisect_right(self.covered_starts[version], start) - 1
+        return i >= 0 and end <= intervals[i][1]
+
+    # canonical single addresses in the index, e.g. for exact lookups in another store
+    def single_addresses(self):
+        return list(self.addresses)
+
+    def has_ranges(self):
+        return bool(self.range_entries)
+
+    # search terms that cover every entry with as few terms as possible: adjacent addresses, CIDRs and
+    # ranges are merged and the merged ranges written as CIDRs; a single address is written without a prefix
+    def search_terms(self):
+        ranges = [e[:3] for e in self.range_entries]
+        for address in self.addresses:
+            ip = ipaddress.ip_address(address)
+            ranges.append((ip.version, int(ip), int(ip)))
+        return aggregate_cidrs(ranges)
+
+    # mark every CIDR and range entry that contains a matched address as found; the matched addresses are
+    # sorted once and each entry is checked with a bisect for the first matched address at or after its start
+    def resolve_matched(self):
+        for version in (4, 6):
+            values = sorted(self.matched[version])
+            for v, start, end, entry in self.range_entries:
+                if v == version:
+                    i = bisect.bisect_left(values, start)
+                    if i < len(values) and values[i] <= end:
+                        self.found.add(entry)
+
+    # entries that did not match any address; single addresses first, then CIDRs and ranges
+    def not_found(self):
+        self.resolve_matched()
+        entries = [e for texts in self.addresses.values() for e in texts] + [e[3] for e in self.range_entries]
+        return [e for e in dict.fromkeys(entries) if e not in self.found]
+
+# convert an IPv4 address into an integer with inet_pton, which only accepts canonical dotted quads; returns
+# None for anything else
+def ipv4_value(text):
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, text), 'big')
+    except (OSError, ValueError):
+        return None
+
+# parse an IPv4 address, CIDR or start-end range into an inclusive (4, start, end) triple without creating
+# ipaddress objects; returns None for anything else, which is left to parse_scope_token
+def parse_ipv4_token(text):
+    if '/' in text:
+        address, _, prefix = text.partition('/')
+        hostmask = IPV4_HOSTMASKS.get(prefix)
+        start = ipv4_value(address)
+        if hostmask is None or start is None:
+            return None
+        # host bits are cleared like ipaddress.ip_network(strict=False)
+        start &= ~hostmask
+        return 4, start, start | hostmask
+    if '-' in text:
+        first, _, last = text.partition('-')
+        start = ipv4_value(first)
+        end = ipv4_value(last)
+        if start is None or end is None or start > end:
+            return None
+        return 4, start, end
+    value = ipv4_value(text)
+    if value is None:
+        return None
+    return 4, value, value
+
+# parse one scope token the slow way: anything parse_range accepts plus short ranges such as 10.0.0.1-20,
+# where the end only gives the last octet
+def parse_scope_token(text):
+    parsed = parse_range(text)
+    if parsed is None and '-' in text:
+        first, _, last = text.partition('-')
+        start = parse_address(first)
+        if start is not None and start.version == 4 and last.isdigit() and int(last) <= 255:
+            end = int(start) & ~0xff | int(last)
+            if end >= int(start):
+                return 4, int(start), end
+    return parsed
+
+# IPv4 start/end columns are arrays of unsigned 32 bit integers; IPv6 values do not fit a machine integer and
+# are kept in lists
+# normalized site scope: one row per address, CIDR or range with its address family, inclusive start and end,
+# and the index of the scope entry it came from; hostnames and entries that could not be parsed are kept as
+# (entry index, text) pairs
+class ScopeTable:
+    def __init__(self):
+        self.starts = {4: array('I'), 6: []}
+        self.ends = {4: array('I'), 6: []}
+        self.sources = {4: array('L'), 6: []}
+        self.hostnames = []
+        self.invalid = []
+
+    def __len__(self):
+        return len(self.starts[4]) + len(self.starts[6])
+
+    def add(self, source, version, start, end):
+        self.starts[version].append(start)
+        self.ends[version].append(end)
+        self.sources[version].append(source)
+
+    # rows as (version, start, end) triples, IPv4 first, e.g. for find_overlapping_ranges or aggregate_cidrs
+    def ranges(self):
+        return [(4, start, end) for start, end in zip(self.starts[4], self.ends[4])] + [(6, start, end) for start, end in zip(self.starts[6], self.ends[6])]
+
+    # entry index of every row, in the same order as ranges()
+    def range_sources(self):
+        return list(self.sources[4]) + self.sources[6]
+
+    # sorted disjoint (start, end) ranges covering every row of one address family
+    def merged(self, version):
+        return merge_ranges(zip(self.starts[version], self.ends[version]))
+
+    # the smallest list of CIDRs covering every row, IPv4 first
+    def cidrs(self):
+        cidrs = []
+        for version in (4, 6):
+            for start, end in self.merged(version):
+                cidrs += range_to_cidrs(version, start, end)
+        return cidrs
+
+# add the IPv4 addresses, CIDRs and start-end ranges in entries to table one token at a time; returns the other
+# tokens as (entry index, text) pairs
+def add_ipv4_tokens(table, entries):
+    others = []
+    for source, entry in enumerate(entries):
+        for token in entry.replace(',', ' ').split():
+            parsed = parse_ipv4_token(token)
+            if parsed is None:
+                others.append((source, token))
+            else:
+                table.add(source, *parsed)
+    return others
+
+# split scope entries into tokens and normalize them into a ScopeTable
+# an entry may hold several addresses, CIDRs, ranges or hostnames separated by commas or whitespace. IPv4
+# tokens, by far the most common, are converted by add_ipv4_tokens without ipaddress objects; IPv6 and anything
+# else go through parse_scope_token. Tokens that still cannot be parsed are recorded as hostnames or invalid.
+def normalize_scope(entries):
+    table = ScopeTable()
+    for source, token in add_ipv4_tokens(table, entries):
+        # a hostname needs a letter and cannot hold ':', so no address, CIDR or range is taken for one
+        if HOSTNAME.match(token):
+            table.hostnames.append((source, token))
+            continue
+        parsed = parse_scope_token(token)
+        if parsed is None:
+            table.invalid.append((source, token))
+        else:
+            table.add(source, *parsed)
+    return table
+
+# hostnames and entries that could not be parsed, without duplicates and in sorted order
+def scope_other_entries(table):
+    return sorted(set(text for _, text in table.hostnames + table.invalid))
+
+# digest of the addresses a ScopeTable covers and of its other entries; two tables with the same digest describe
+# the same scope however their entries are written, ordered, split or duplicated
+def scope_digest(table):
+    digest = hashlib.sha256()
+    for cidr in table.cidrs():
+        digest.update(cidr.encode() + b'\n')
+    digest.update(b'\0')
+    for text in scope_other_entries(table):
+        digest.update(text.encode() + b'\n')
+    return digest.hexdigest()
+
+# changes from the old ScopeTable to the new one: the addresses added and removed as minimal CIDR lists and the
+# hostnames and other entries added and removed
+def diff_scopes(old, new):
+    diff = {'added': [], 'removed': [], 'added_entries': [], 'removed_entries': []}
+    for version in (4, 6):
+        old_ranges = old.merged(version)
+        new_ranges = new.merged(version)
+        for start, end in subtract_ranges(new_ranges, old_ranges):
+            diff['added'] += range_to_cidrs(version, start, end)
+        for start, end in subtract_ranges(old_ranges, new_ranges):
+            diff['removed'] += range_to_cidrs(version, start, end)
+    old_other = set(scope_other_entries(old))
+    new_other = set(scope_other_entries(new))
+    diff['added_entries'] = sorted(new_other - old_other)
+    diff['removed_entries'] = sorted(old_other - new_other)
+    return diff
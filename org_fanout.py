@@ -0,0 +1,38 @@
+# org_fanout.py
+#
+# Run blocking per-organization work concurrently across an account.
+#
+# for_each_org calls a function once per organization on a thread pool and returns the results in the
+# same order as the organizations, so scripts can fan out their API calls and still write their output
+# in a stable order. The number of organizations processed at once defaults to ORG_CONCURRENCY and can be
+# set with RUNZERO_ORG_CONCURRENCY in .env; a concurrency of 1 runs everything in the calling thread.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+ORG_CONCURRENCY = 8
+
+# return the configured number of organizations processed at the same time
+def org_concurrency():
+    return max(1, int(os.getenv('RUNZERO_ORG_CONCURRENCY', ORG_CONCURRENCY)))
+
+# call fn(item) for every item with at most concurrency calls running at once and return the results in order
+# if a call fails (including exit() in a worker), calls that have not started are cancelled and the error is
+# raised in the calling thread
+def parallel_map(fn, items, concurrency=None):
+    items = list(items)
+    concurrency = min(concurrency or org_concurrency(), len(items) or 1)
+    if concurrency <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(fn, item) for item in items]
+        try:
+            return [f.result() for f in futures]
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+
+# call fn(org) for every organization and return the results in organization order
+def for_each_org(orgs, fn, concurrency=None):
+    return parallel_map(fn, orgs, concurrency)
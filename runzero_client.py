@@ -0,0 +1,181 @@
+# runzero_client.py
+#
+# Shared HTTP client for all scripts and health checks.
+#
+# Every request goes through one pooled requests.Session, so connections (and their TLS handshakes) are
+# reused across calls and across the threads used by concurrent scripts. Requests get a default timeout,
+# and responses with status 429 or 5xx are retried with exponential backoff that honours Retry-After.
+# POST and PUT requests are only retried on 429, because the server has not processed a rate limited request;
+# other POST and PUT failures may have been applied already (e.g. creating assets or importing scan data) and
+# are left to the caller.
+#
+# Use the module level get/post/patch/put/delete functions in place of requests.get/post/...
+# Scripts that retry failed requests themselves pass retries=False, which sends the request through a second
+# pooled session that returns every response (and raises every connection error) without retrying, so the
+# retries are not multiplied and the script sees each 429 and its Retry-After.
+#
+# get_token exchanges a client id and secret for an access token and caches it per base URL and client id
+# until shortly before it expires. Concurrent callers wait for a single exchange instead of each requesting
+# a token. Set RUNZERO_TOKEN_CACHE in .env to a file path to also share tokens between runs; the file is
+# only readable by its owner.
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# connection pools kept (one per host) and connections kept per host; the per-host size should cover the
+# most concurrent requests a script makes, e.g. org fan-out times tag or delete workers
+POOL_CONNECTIONS = 8
+POOL_MAXSIZE = 32
+
+# retries for 429/5xx responses and connection errors; the delay doubles from BACKOFF_FACTOR seconds
+# unless the response carries a Retry-After header
+RETRIES = 5
+BACKOFF_FACTOR = 1
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# seconds to wait for a connection and for each read from the server
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 300
+
+# refresh cached tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 60
+
+# lifetime assumed for tokens whose response does not include expires_in
+TOKEN_DEFAULT_LIFETIME = 3600
+
+# raised when an access token cannot be obtained
+class TokenError(Exception):
+    pass
+
+# retry policy that also retries rate limited requests of methods that are not otherwise retried
+class RateLimitRetry(Retry):
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 429 and self.total:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+# session that applies the default timeout to every request that does not set one
+class ClientSession(requests.Session):
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+        return super().request(method, url, **kwargs)
+
+_sessions = {}
+_session_lock = threading.Lock()
+
+def new_session(retries=True):
+    if retries:
+        retry = RateLimitRetry(
+            total=RETRIES,
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS - {'PUT'} | {'PATCH'},
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+    else:
+        retry = Retry(total=0, read=False, redirect=None, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session = ClientSession()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# return the shared session, or the shared session without retries, creating it on first use
+def get_session(retries=True):
+    session = _sessions.get(retries)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(retries)
+            if session is None:
+                session = _sessions[retries] = new_session(retries)
+    return session
+
+def get(url, retries=True, **kwargs):
+    return get_session(retries).get(url, **kwargs)
+
+def post(url, retries=True, **kwargs):
+    return get_session(retries).post(url, **kwargs)
+
+def patch(url, retries=True, **kwargs):
+    return get_session(retries).patch(url, **kwargs)
+
+def put(url, retries=True, **kwargs):
+    return get_session(retries).put(url, **kwargs)
+
+def delete(url, retries=True, **kwargs):
+    return get_session(retries).delete(url, **kwargs)
+
+_tokens = {}
+_token_lock = threading.Lock()
+
+def token_cache_path():
+    return os.getenv('RUNZERO_TOKEN_CACHE')
+
+def read_token_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# write the token cache atomically with owner only permissions
+def write_token_cache(path, cache):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.runzero_token_')
+    try:
+        os.chmod(tmp, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def token_is_fresh(entry):
+    return entry is not None and entry.get('expires_at', 0) - TOKEN_REFRESH_MARGIN > time.time()
+
+# return an access token for the client credentials, requesting a new one only when there is no cached
+# token or the cached token is about to expire
+def get_token(base_url, client_id, client_secret):
+    key = base_url.rstrip('/') + ' ' + (client_id or '')
+    with _token_lock:
+        entry = _tokens.get(key)
+        if token_is_fresh(entry):
+            return entry['access_token']
+
+        path = token_cache_path()
+        cache = read_token_cache(path) if path else {}
+        entry = cache.get(key)
+        if token_is_fresh(entry):
+            _tokens[key] = entry
+            return entry['access_token']
+
+        url = f'{base_url}/account/api/token'
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        data = {"grant_type": "client_credentials"}
+        response = post(url, data=data, headers=headers, verify=True, auth=(client_id, client_secret))
+        if response.status_code != 200:
+            raise TokenError('Failed to obtain token from OAuth server. Status code ' + str(response.status_code) + '. ' + response.text)
+        token_json = response.json()
+        entry = {
+            'access_token': token_json['access_token'],
+            'expires_at': time.time() + int(token_json.get('expires_in') or TOKEN_DEFAULT_LIFETIME)
+        }
+        _tokens[key] = entry
+        if path:
+            cache = {k: v for k, v in read_token_cache(path).items() if token_is_fresh(v)}
+            cache[key] = entry
+            write_token_cache(path, cache)
+        return entry['access_token']
+
+# asyncio version of get_token; the exchange runs in a worker thread so the event loop is not blocked
+async def get_token_async(base_url, client_id, client_secret):
+    return await asyncio.to_thread(get_token, base_url, client_id, client_secret)
@@ -0,0 +1,306 @@
+# runzero_export.py
+#
+# Shared helpers for the export scripts: compressed download of /export/org/* endpoints, incremental
+# parsing of json responses and streaming output writers for csv, gzipped jsonl, parquet and arrow
+# ipc files.
+#
+# Exports are requested with gzip transfer encoding, or zstd when the zstandard package is installed,
+# and decompressed incrementally as they are parsed. Parquet and arrow output require pyarrow
+# (pip install pyarrow); everything else only needs requests and the standard library.
+
+import codecs
+import contextlib
+import csv
+import gzip
+import json
+import tempfile
+import zlib
+import urllib3
+import runzero_client
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# errors raised while a response body is read or decompressed; response.raw bypasses the wrapping that
+# requests does in its own iter_content, so these are turned into ExportError here
+STREAM_ERRORS = (urllib3.exceptions.HTTPError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+# content encodings requested from export endpoints, in order of preference
+ACCEPT_ENCODING = 'zstd, gzip' if zstandard else 'gzip'
+
+OUTPUT_FORMATS = ['csv', 'jsonl.gz', 'parquet', 'arrow']
+
+# number of rows buffered before a parquet row group or arrow record batch is written
+ROW_GROUP_SIZE = 50000
+
+# characters stripped from the json representation of array attributes in csv output
+LIST_STRIP_TABLE = str.maketrans('', '', '[]{}"')
+
+# raised when an export request fails
+class ExportError(Exception):
+    pass
+
+# return an incremental decompressor for a content encoding, or None for uncompressed responses
+def new_decompressor(encoding):
+    if encoding in ('', 'identity'):
+        return None
+    elif encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(wbits=31)
+    elif encoding == 'deflate':
+        return zlib.decompressobj()
+    elif encoding == 'zstd' and zstandard:
+        return zstandard.ZstdDecompressor().decompressobj()
+    else:
+        raise ExportError('Unsupported content encoding ' + encoding)
+
+# streamed export response that is decompressed as it is read
+# wire_bytes counts bytes received from the network and decoded_bytes the bytes after decompression
+class ExportStream:
+    def __init__(self, response):
+        self.response = response
+        self.encoding = response.headers.get('Content-Encoding', '').strip().lower() or 'identity'
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+
+    # a connection dropped mid-export or a corrupt compressed body raises ExportError
+    def iter_content(self, chunk_size=1024*1024):
+        try:
+            yield from self.iter_decoded(chunk_size)
+        except STREAM_ERRORS as e:
+            raise ExportError(f'Export stream failed after {self.wire_bytes} bytes: {e!r}') from e
+
+    def iter_decoded(self, chunk_size):
+        decompressor = new_decompressor(self.encoding)
+        for raw in self.response.raw.stream(chunk_size, decode_content=False):
+            self.wire_bytes += len(raw)
+            if decompressor is None:
+                data = raw
+            else:
+                data = decompressor.decompress(raw)
+                # concatenated gzip members or zstd frames each need a new decompressor
+                while getattr(decompressor, 'eof', False) and decompressor.unused_data:
+                    unused = decompressor.unused_data
+                    decompressor = new_decompressor(self.encoding)
+                    data += decompressor.decompress(unused)
+            self.decoded_bytes += len(data)
+            if data:
+                yield data
+        if decompressor is not None:
+            data = decompressor.flush()
+            self.decoded_bytes += len(data)
+            if data:
+                yield data
+
+    # one line summary of the transfer for metered egress reporting
+    def summary(self, label):
+        ratio = self.decoded_bytes / self.wire_bytes if self.wire_bytes else 1
+        return f'{label}: {self.wire_bytes / 1e6:.1f} MB on the wire, {self.decoded_bytes / 1e6:.1f} MB decoded ({ratio:.1f}x, {self.encoding})'
+
+# request an export endpoint with compressed transfer and yield it as an ExportStream
+@contextlib.contextmanager
+def open_export(url, token):
+    headers = {"Content-Type": "application/json", "Authorization": "Bearer " + token, "Accept-Encoding": ACCEPT_ENCODING}
+    with runzero_client.get(url, headers=headers, stream=True) as response:
+        if response.status_code != 200:
+            raise ExportError('Failed to export from ' + url + '. Status code ' + str(response.status_code) + '.')
+        yield ExportStream(response)
+
+# stream the top level array of a json export one element at a time
+# the response body is decoded and parsed in chunks so only the current element is held in memory
+def iter_json_array(response, chunk_size=1024*1024):
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    started = False
+    finished = False
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+        while True:
+            # skip whitespace and separators between array elements
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('Export response is not a JSON array')
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                finished = True
+                pos += 1
+                break
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # element is split across chunks; wait for more data
+                break
+            # a scalar split across chunks can decode early (e.g. 12 from 12.5), so only
+            # accept an element once the separator that follows it has arrived
+            next_pos = end
+            while next_pos < len(buffer) and buffer[next_pos] in ' \t\r\n':
+                next_pos += 1
+            if next_pos >= len(buffer) or buffer[next_pos] not in ',]':
+                break
+            pos = end
+            yield element
+        if finished:
+            break
+    if not finished:
+        raise ValueError('Export response ended before the JSON array was closed')
+
+# flatten an array or object into a plain comma separated string for csv output
+def flatten_value(value):
+    return json.dumps(value).translate(LIST_STRIP_TABLE)
+
+# convert an array or object into a list of strings for columnar output
+# objects such as tags become key=value entries
+def to_string_list(value):
+    if value in ('', None):
+        return None
+    if isinstance(value, dict):
+        return [k + '=' + str(v) if v not in ('', None) else k for k, v in value.items()]
+    if isinstance(value, list):
+        return [v if isinstance(v, str) else json.dumps(v) for v in value]
+    return [str(value)]
+
+# convert a scalar into a string for columnar output; nested values are kept as json
+def to_string(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+class CsvWriter:
+    def __init__(self, path, columns, list_columns):
+        self.file = open(path, mode='w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=columns)
+        self.list_columns = [c for c in columns if c in list_columns]
+        self.writer.writeheader()
+
+    def write(self, record):
+        for c in self.list_columns:
+            record[c] = flatten_value(record.get(c, ''))
+        self.writer.writerow(record)
+
+    def close(self):
+        self.file.close()
+
+class JsonlGzWriter:
+    def __init__(self, path, columns, list_columns):
+        self.file = gzip.open(path, mode='wt', encoding='utf-8')
+        self.columns = columns
+
+    def write(self, record):
+        self.file.write(json.dumps({c: record.get(c) for c in self.columns}) + '\n')
+
+    def close(self):
+        self.file.close()
+
+# parquet and arrow writer; rows are buffered and written one row group at a time
+# list columns are stored as list<string> and all other columns as string
+class ArrowWriter:
+    def __init__(self, path, columns, list_columns, output_format):
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            print('pyarrow is required for ' + output_format + ' output (pip install pyarrow).')
+            exit(1)
+        self.pa = pyarrow
+        self.columns = columns
+        self.list_columns = set(c for c in columns if c in list_columns)
+        self.schema = pyarrow.schema([
+            (c, pyarrow.list_(pyarrow.string()) if c in self.list_columns else pyarrow.string()) for c in columns
+        ])
+        if output_format == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+        else:
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+        self.output_format = output_format
+        self.buffer = {c: [] for c in columns}
+        self.buffered = 0
+
+    def write(self, record):
+        for c in self.columns:
+            value = record.get(c)
+            self.buffer[c].append(to_string_list(value) if c in self.list_columns else to_string(value))
+        self.buffered += 1
+        if self.buffered >= ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.buffered:
+            return
+        arrays = [self.pa.array(self.buffer[c], type=self.schema.field(c).type) for c in self.columns]
+        table = self.pa.Table.from_arrays(arrays, schema=self.schema)
+        if self.output_format == 'parquet':
+            self.writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+        else:
+            self.writer.write_table(table, max_chunksize=ROW_GROUP_SIZE)
+        self.buffer = {c: [] for c in self.columns}
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+# open a streaming writer for the given output format
+# records are dicts keyed by column; list_columns hold arrays or objects that are kept as lists
+# in jsonl, parquet and arrow output and flattened into a single value in csv output
+def open_writer(path, output_format, columns, list_columns=()):
+    if output_format == 'csv':
+        return CsvWriter(path, columns, list_columns)
+    elif output_format == 'jsonl.gz':
+        return JsonlGzWriter(path, columns, list_columns)
+    elif output_format in ('parquet', 'arrow'):
+        return ArrowWriter(path, columns, list_columns, output_format)
+    else:
+        raise ValueError('Unsupported output format ' + output_format + '; expected one of ' + ', '.join(OUTPUT_FORMATS))
+
+# write rows whose columns are not known up front in two passes with constant memory
+# the first pass spills rows to a temporary jsonl file while counting how often each key appears;
+# the second pass writes the output with the union of all keys as columns
+# keys present in fewer than min_key_frequency (0 to 1) of the rows are pruned; fixed_columns are always kept
+# returns the number of rows written and the list of pruned keys
+def write_discovered_columns(rows, path, output_format, fixed_columns, min_key_frequency=0):
+    key_counts = {}
+    row_count = 0
+    with tempfile.TemporaryFile(mode='w+', encoding='utf-8') as spill:
+        for row in rows:
+            for key in row:
+                key_counts[key] = key_counts.get(key, 0) + 1
+            spill.write(json.dumps(row) + '\n')
+            row_count += 1
+
+        min_count = min_key_frequency * row_count
+        columns = list(fixed_columns)
+        pruned = []
+        for key, count in key_counts.items():
+            if key in fixed_columns:
+                continue
+            if count < min_count:
+                pruned.append(key)
+            else:
+                columns.append(key)
+
+        spill.seek(0)
+        writer = open_writer(path, output_format, columns)
+        try:
+            for line in spill:
+                row = json.loads(line)
+                for key in pruned:
+                    row.pop(key, None)
+                writer.write(row)
+        finally:
+            writer.close()
+    return row_count, pruned
@@ -0,0 +1,90 @@
+'''
+    Fills the local asset index (asset_index.py) used by the --from-index mode of tag_assets_cross_org.py,
+    delete_bulk_assets.py and export_assets_to_csv.py.
+
+    * An oauth client ID and secret from a runZero account is needed to run this script.
+    * The id, addresses, macs, names, type, site and tags of every asset in every organization are stored.
+    * Queries listed in INDEX_QUERIES are run as id-only searches in every organization and their matches
+      are stored, so scripts that select assets with one of these queries can resolve them locally.
+      Add the QUERY of delete_bulk_assets.py or export_assets_to_csv.py here to use them with --from-index.
+    * The index is replaced in a single transaction, so scripts reading it never see a partial sync.
+
+    Schedule this script ahead of the scripts that read the index, e.g. hourly from cron.
+'''
+
+from dotenv import load_dotenv
+import os
+import runzero_client
+import json
+from datetime import datetime
+import asset_index
+
+load_dotenv()
+RUNZERO_CLIENT_ID = os.getenv("RUNZERO_CLIENT_ID")
+RUNZERO_CLIENT_SECRET = os.getenv("RUNZERO_CLIENT_SECRET")
+RUNZERO_BASE_URL = 'https://console.runzero.com/api/v1.0'
+
+# Queries whose matching asset ids are stored in the index
+INDEX_QUERIES = [
+    'last_seen:<30d and (type:desktop or type:laptop)',
+]
+
+# Authentication with client ID and secret and obtain bearer token
+def get_token():
+    try:
+        return runzero_client.get_token(RUNZERO_BASE_URL, RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET)
+    except runzero_client.TokenError as e:
+        print(e)
+        exit(1)
+
+# Get all organization within defined account
+def get_organizations(token):
+    orgs = runzero_client.get(f'{RUNZERO_BASE_URL}/account/orgs', headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    if orgs.status_code != 200:
+        print("Failed to retrieve organization data.")
+        exit(1)
+    return json.loads(orgs.text)
+
+# Get assets within specified organization, optionally filtered by a search query
+def get_assets(token, org_id, fields, search=None):
+    params = {'_oid': org_id, 'fields': fields}
+    if search:
+        params['search'] = search
+    assets = runzero_client.get(f'{RUNZERO_BASE_URL}/org/assets', params=params, headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+    if assets.status_code != 200:
+        print(f"Failed to retrieve asset data for org {org_id}.")
+        exit(1)
+    return assets.json()
+
+def main():
+    access_token = get_token()
+    orgs = get_organizations(access_token)
+    db = asset_index.open_index()
+    asset_index.clear_query_matches(db)
+
+    for o in orgs:
+        org_id = o.get('id', '')
+        org_name = o.get('name', '')
+
+        assets = get_assets(access_token, org_id, asset_index.INDEX_FIELDS)
+        count = asset_index.replace_org_assets(db, org_id, org_name, assets)
+        print(datetime.now().strftime('%Y%m%d %H:%M:%S ') + 'indexed ' + str(count) + ' assets from ' + org_name + ' (' + org_id + ')')
+
+        for query in INDEX_QUERIES:
+            matches = get_assets(access_token, org_id, 'id', search=query)
+            asset_index.replace_query_matches(db, query, org_id, [a['id'] for a in matches])
+
+    # Remove organizations that are no longer part of the account
+    org_ids = [o.get('id', '') for o in orgs]
+    for (org_id,) in db.execute('SELECT id FROM orgs').fetchall():
+        if org_id not in org_ids:
+            asset_index.replace_org_assets(db, org_id, '', [])
+            db.execute('DELETE FROM orgs WHERE id = ?', (org_id,))
+
+    asset_index.mark_synced(db)
+    db.commit()
+    db.close()
+    print('Asset index saved to ' + os.path.abspath(asset_index.index_path()))
+
+if __name__ == '__main__':
+    main()
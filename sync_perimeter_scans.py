@@ -11,7 +11,7 @@
 #     4) run python3 sync_perimeter_scans.py
 
 from dotenv import load_dotenv
-import requests
+import runzero_client
 import logging
 import os
 
@@ -38,7 +38,7 @@ DELETE_LOCAL_FILES = True
 
 def get_tasks():
     url = f'https://{SAAS_BASE_URL}/api/v1.0/org/tasks?search={SAAS_TASK_SEARCH_FILTER}&_oid={SAAS_ORG_ID}'
-    response = requests.get(url, headers={"Content-Type": "application/json", "Authorization": "Bearer " + SAAS_ORG_TOKEN})
+    response = runzero_client.get(url, headers={"Content-Type": "application/json", "Authorization": "Bearer " + SAAS_ORG_TOKEN})
 
     if response.status_code == 200:
         logging.info(f'Successfully downloaded completed scan tasks from {SAAS_BASE_URL}')
@@ -50,7 +50,7 @@ def get_tasks():
 def get_task_data(task_id):
     url = f'https://{SAAS_BASE_URL}/api/v1.0/org/tasks/{task_id}/data'
     with open(f'scan_{task_id}.json.gz', 'wb') as f:
-        response = requests.get(url, headers={"Content-Type": "application/octet-stream", "Authorization": "Bearer " + SAAS_ORG_TOKEN}, stream=True)
+        response = runzero_client.get(url, headers={"Content-Type": "application/octet-stream", "Authorization": "Bearer " + SAAS_ORG_TOKEN}, stream=True)
 
         if response.status_code == 200:
             logging.info(f'Successfully downloaded task {task_id} from {SAAS_BASE_URL}')
@@ -66,7 +66,7 @@ def get_task_data(task_id):
 def upload_task_data(task_id, task_data):
     url = f'https://{SELF_BASE_URL}/api/v1.0/org/sites/{SELF_SITE_ID}/import?_oid={SELF_ORG_ID}'
     with open(f'scan_{task_id}.json.gz', 'rb') as file:
-        response = requests.put(url, headers={"Content-Type": "application/octet-stream", "Authorization": "Bearer " + SELF_ORG_TOKEN}, verify=False, stream=True, data=file)
+        response = runzero_client.put(url, headers={"Content-Type": "application/octet-stream", "Authorization": "Bearer " + SELF_ORG_TOKEN}, verify=False, stream=True, data=file)
         
         if response.status_code == 200:
             logging.info(f'Successfully uploaded task {task_id} to {SELF_BASE_URL}')
@@ -77,7 +77,7 @@ def upload_task_data(task_id, task_data):
     
 def hide_task(task_id):
     url = f'https://{SAAS_BASE_URL}/api/v1.0/org/tasks/{task_id}/hide?_oid={SAAS_ORG_ID}'
-    response = requests.post(url, headers={"Content-Type": "application/json", "Authorization": "Bearer " + SAAS_ORG_TOKEN})   
+    response = runzero_client.post(url, headers={"Content-Type": "application/json", "Authorization": "Bearer " + SAAS_ORG_TOKEN})   
 
     if response.status_code == 200:
         logging.info(f'Task {task_id} was successfully hidden on {SAAS_BASE_URL}')
@@ -1,9 +1,16 @@
 import requests
+import runzero_client
 import os
 import json
 import csv
 import sys
 import logging
+import ipaddress
+import time
+from concurrent.futures import ThreadPoolExecutor
+import asset_index
+from ip_ranges import AddressIndex
+from org_fanout import for_each_org
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -15,6 +22,7 @@ RUNZERO_BASE_URL = 'https://console.runzero.com/api/v1.0'
 ''' 
 Set CSV_FILE to the location of the file you want to read in.
 Set CSV_COLUMN to the column where the IP address is located. Column A is 0. 
+The column may hold single IPv4/IPv6 addresses, CIDRs (10.1.0.0/16) or ranges (10.1.0.10-10.1.0.20).
 Set CSV_HEADER to True if your CSV file contains a header row or False is no header.
 '''
 CSV_FILE = 'tag_assets_cross_org.csv'
@@ -24,6 +32,27 @@ CSV_HEADER = True
 # Set tag to apply to all assets discovered in CSV_FILE
 TAG = 'INFRA'
 
+# Matched assets are tagged in bulk, TAG_BATCH_SIZE assets per request, with up to TAG_WORKERS requests at a time.
+# Batches that fail are queued and retried up to TAG_RETRIES times once every organization has been processed.
+# These are the only retries for tag requests; they bypass the retries of the shared HTTP client.
+TAG_BATCH_SIZE = 500
+TAG_WORKERS = 4
+TAG_RETRIES = 3
+
+# Set PUSHDOWN to choose how assets are found in each organization:
+#   'auto'   - estimate the cost of both strategies from the organization's asset count and pick the cheaper one
+#   'always' - search for the CSV addresses with address: queries and only download candidate assets
+#   'never'  - download every asset in the organization and match locally
+# Addresses are merged into CIDR terms where possible and sent PUSHDOWN_CHUNK_SIZE terms per query.
+# PUSHDOWN_REQUEST_COST is the cost of one extra request, expressed as a number of downloaded assets.
+PUSHDOWN = 'auto'
+PUSHDOWN_CHUNK_SIZE = 100
+PUSHDOWN_REQUEST_COST = 2000
+
+# Set FROM_INDEX to True or pass --from-index to look up assets in the local asset index built by
+# sync_asset_index.py instead of downloading them from every organization. Tags are still applied through the API.
+FROM_INDEX = '--from-index' in sys.argv
+
 # Path to the list of IPs that were not found and tagged
 OUTPUT_FILE = 'tag_assets_cross_org.log'
 
@@ -39,22 +68,17 @@ logging.basicConfig(
 
 # Authenticate with client ID and secret and obtain bearer token
 def get_token():
-    url = f'{RUNZERO_BASE_URL}/account/api/token'
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = {"grant_type": "client_credentials"}
-    response = requests.post(url, headers=headers, verify=True, data=data, auth=(RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET))
-    if response.status_code != 200:
-        logging.error('Failed to obtain token from OAuth server. Status code ' + token_response.status_code + '.')
-        logging.error(response.text)
+    try:
+        return runzero_client.get_token(RUNZERO_BASE_URL, RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET)
+    except runzero_client.TokenError as e:
+        logging.error(str(e))
         exit(1)
-    token_json = json.loads(response.text)
-    return token_json['access_token']   
 
 # Fetch organizations from account
 def get_organizations(token):
     url = f'{RUNZERO_BASE_URL}/account/orgs'
     headers = {"Content-Type": "application/json", "Authorization": "Bearer " + token}
-    response = requests.get(url, headers=headers)
+    response = runzero_client.get(url, headers=headers)
     if response.status_code != 200:
         logging.error('Failed to retrieve organization data. Status code ' + response.status_code + '.')
         logging.error(response.text)
@@ -65,32 +89,160 @@ def get_organizations(token):
         return json.loads(response.text)
 
 # Fetch assets from organization
-def get_assets(token, org_id):
-    fields = 'id,addresses'
+def get_assets(token, org_id, search=None):
+    fields = 'id,addresses,tags'
     url = f'{RUNZERO_BASE_URL}/org/assets?_oid={org_id}&fields={fields}'
     headers = headers={"Content-Type": "application/json", "Authorization": "Bearer " + token}
-    response = requests.get(url, headers=headers)
+    params = {'search': search} if search else None
+    response = runzero_client.get(url, headers=headers, params=params)
     if response.status_code != 200:
         logging.error('Failed to retrieve asset data. Status code ' + assets.status_code + '.')
         logging.error(response.text)
         exit(1)
     return response
 
-def tag_asset(token, org_id, uuid):
-    url = f'{RUNZERO_BASE_URL}/org/assets/{uuid}/tags?_oid={org_id}'
+# Fetch only the assets that have one of the given addresses or fall into one of the given CIDRs
+def search_assets(token, org_id, terms):
+    assets = {}
+    for i in range(0, len(terms), PUSHDOWN_CHUNK_SIZE):
+        search = ' or '.join('address:' + t for t in terms[i:i + PUSHDOWN_CHUNK_SIZE])
+        for a in get_assets(token, org_id, search).json():
+            assets[a.get('id', '')] = a
+    return list(assets.values())
+
+# Estimate the number of assets in an organization from the asset counts of its sites
+def get_asset_count(token, org_id):
+    url = f'{RUNZERO_BASE_URL}/org/sites?_oid={org_id}'
     headers = {"Content-Type": "application/json", "Authorization": "Bearer " + token}
-    data = {"tags": TAG}
-    response = requests.patch(url, headers=headers, json=data)
+    response = runzero_client.get(url, headers=headers)
     if response.status_code != 200:
-        logging.error('Failed to tag asset ' + uuid + ' in org_id ' + org_id + '. Status code ' + str(response.status_code) + '.')
+        logging.error('Failed to retrieve site data. Status code ' + str(response.status_code) + '.')
         logging.error(response.text)
         exit(1)
-    return
+    return sum(s.get('asset_count', 0) or 0 for s in response.json())
+
+# Decide whether to search for the addresses or download every asset in an organization
+# a full scan costs one request plus every asset; a pushdown costs one request per chunk of terms plus the
+# matching assets, which are at most one per address term (CIDR terms are counted as full scans of their size)
+def use_pushdown(token, org_id, terms, search_size):
+    if PUSHDOWN == 'always':
+        return True
+    if PUSHDOWN == 'never' or not terms:
+        return False
+    asset_count = get_asset_count(token, org_id)
+    requests_needed = -(-len(terms) // PUSHDOWN_CHUNK_SIZE)
+    pushdown_cost = requests_needed * PUSHDOWN_REQUEST_COST + min(search_size, asset_count)
+    full_scan_cost = PUSHDOWN_REQUEST_COST + asset_count
+    return pushdown_cost < full_scan_cost
+
+# Return True if an asset's tags already reflect TAG, so tagging it again would not change anything
+# TAG may hold several space separated tags; name=value must match the value, a bare name only needs the
+# name, and -name (tag removal) requires the name to be absent
+def has_tag(asset_tags):
+    asset_tags = asset_tags or {}
+    for t in TAG.split():
+        if t.startswith('-'):
+            if t[1:] in asset_tags:
+                return False
+            continue
+        name, sep, value = t.partition('=')
+        if name not in asset_tags or (sep and str(asset_tags[name]) != value):
+            return False
+    return True
+
+# Tag a batch of assets with one bulk request; the assets are selected with an id search
+def tag_batch(token, org_id, uuids):
+    url = f'{RUNZERO_BASE_URL}/org/assets/bulk/tags?_oid={org_id}'
+    headers = {"Content-Type": "application/json", "Authorization": "Bearer " + token}
+    data = {"search": ' or '.join('id:' + u for u in uuids), "tags": TAG}
+    try:
+        response = runzero_client.patch(url, headers=headers, json=data, retries=False)
+    except requests.RequestException as e:
+        logging.error('Failed to tag ' + str(len(uuids)) + ' assets in org_id ' + org_id + '. ' + str(e))
+        return False
+    if response.status_code not in (200, 204):
+        logging.error('Failed to tag ' + str(len(uuids)) + ' assets in org_id ' + org_id + '. Status code ' + str(response.status_code) + '.')
+        logging.error(response.text)
+        return False
+    return True
+
+# Tag assets in batches with bounded concurrency and return the batches that failed
+def tag_assets(token, org_id, uuids):
+    batches = [uuids[i:i + TAG_BATCH_SIZE] for i in range(0, len(uuids), TAG_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=TAG_WORKERS) as executor:
+        results = list(executor.map(lambda b: tag_batch(token, org_id, b), batches))
+    return [(org_id, b) for b, ok in zip(batches, results) if not ok]
+
+# Retry failed batches with an increasing delay and return the ids that still could not be tagged
+def retry_failed_batches(token, retry_queue):
+    for attempt in range(1, TAG_RETRIES + 1):
+        if not retry_queue:
+            break
+        logging.info('Retrying ' + str(len(retry_queue)) + ' failed batches (attempt ' + str(attempt) + ' of ' + str(TAG_RETRIES) + ').')
+        time.sleep(2 ** attempt)
+        failed = []
+        for org_id, uuids in retry_queue:
+            failed.extend(tag_assets(token, org_id, uuids))
+        retry_queue = failed
+    return [(org_id, u) for org_id, uuids in retry_queue for u in uuids]
+
+# Find the assets of an organization that are in addr_index and tag them
+# returns the batches that failed and the number of writes avoided by de-duplicating address matches per
+# asset and by skipping assets that already have the tag
+# terms are the search terms covering addr_index and search_size the number of addresses they cover
+def tag_org(token, o, addr_index, terms, search_size):
+    org_id = o.get('id', '')
+    org_name = o.get('name', '')
+    if FROM_INDEX:
+        logging.info('Looking up assets from ' + org_name + ' (' + org_id + ') in the local asset index.')
+        # sqlite connections cannot be shared between threads, so each organization opens its own
+        index = asset_index.open_index()
+        if addr_index.has_ranges():
+            assets_json = asset_index.get_org_assets(index, org_id)
+        else:
+            assets_json = asset_index.get_assets_by_address(index, org_id, addr_index.single_addresses())
+        index.close()
+    elif use_pushdown(token, org_id, terms, search_size):
+        logging.info('Searching ' + org_name + ' (' + org_id + ') for ' + str(len(terms)) + ' address terms.')
+        assets_json = search_assets(token, org_id, terms)
+    else:
+        logging.info('Fetching assets from ' + org_name + ' (' + org_id + ').')
+        assets = get_assets(token, org_id)
+        assets_json = assets.json()
+
+    # Loop through assets and collect the ones that are found in addr_list
+    # an asset is collected once however many of its addresses match, and only if it still needs the tag
+    asset_counter = 0
+    address_matches = 0
+    already_tagged = 0
+    matched = {}
+    for a in assets_json:
+        uuid = a.get('id', '')
+        addresses = a.get('addresses', [])
+        asset_matches = 0
+        if addresses:
+            for addr in addresses:
+                if addr_index.match(addr):
+                    asset_matches += 1
+        if asset_matches:
+            address_matches += asset_matches
+            if has_tag(a.get('tags')):
+                already_tagged += 1
+            else:
+                matched[uuid] = True
+        asset_counter += 1
+
+    # Tag the matched assets in bulk; failed batches are retried after all organizations are done
+    failed = tag_assets(token, org_id, list(matched))
+    tag_counter = len(matched) - sum(len(b) for _, b in failed)
+    logging.info('Tagged ' + str(tag_counter) + ' of ' + str(asset_counter) + ' assets in ' + org_name + ' (' + org_id + '); ' +
+                 str(already_tagged) + ' matching assets already had the tag.')
+    duplicate_matches = address_matches - len(matched) - already_tagged
+    return failed, duplicate_matches, already_tagged
 
 def main():
 
     addr_list = []
-    addr_not_found_list = []
 
     # Read CSV file
     with open(CSV_FILE, 'r') as csvfile:
@@ -103,37 +255,42 @@ def main():
             if r:
                 addr_list.append(r[CSV_COLUMN])
 
-    # Add all addresses to not found list. Addresses will be removed as they are discovered.
-    addr_not_found_list = addr_list.copy()
+    # Index addresses for constant time lookups; CIDRs and ranges are searched by bisection.
+    # Entries are marked as found as assets match them.
+    addr_index = AddressIndex(addr_list)
+    if addr_index.invalid:
+        logging.warning('Ignoring ' + str(len(addr_index.invalid)) + ' entries that are not addresses, CIDRs or ranges.')
+        logging.warning(addr_index.invalid)
+
+    # Merge addresses into as few search terms as possible for the pushdown strategy
+    terms = addr_index.search_terms() if not FROM_INDEX and PUSHDOWN != 'never' else []
+    search_size = sum(ipaddress.ip_network(t).num_addresses for t in terms)
 
     bearer_token = get_token()
-    orgs = get_organizations(bearer_token)
+    if FROM_INDEX:
+        index = asset_index.open_index()
+        orgs = asset_index.get_organizations(index)
+        index.close()
+    else:
+        orgs = get_organizations(bearer_token)
 
-    # Loop through organizations and search for assets to tag
-    for o in orgs:
-        org_id = o.get('id', '')
-        org_name = o.get('name', '')
-        logging.info('Fetching assets from ' + org_name + ' (' + org_id + ').')
-        assets = get_assets(bearer_token, org_id)
-        assets_json = assets.json()
+    # Search each organization for assets to tag, several organizations at a time
+    results = for_each_org(orgs, lambda o: tag_org(bearer_token, o, addr_index, terms, search_size))
+    retry_queue = [batch for failed, _, _ in results for batch in failed]
+
+    # Report the tag writes that were not needed
+    duplicate_matches = sum(r[1] for r in results)
+    already_tagged = sum(r[2] for r in results)
+    logging.info('Avoided ' + str(duplicate_matches + already_tagged) + ' tag writes: ' + str(duplicate_matches) +
+                 ' repeat matches on assets with several listed addresses and ' + str(already_tagged) + ' assets that already had the tag.')
 
-        # Loop through assets and tag ones that are found in addr_list
-        asset_counter = 0
-        tag_counter = 0
-        for a in assets_json:
-            uuid = a.get('id', '')
-            addresses = a.get('addresses', [])
-            if addresses:
-                for addr in addresses:
-                    if addr in addr_list:
-                        tag_asset(bearer_token, org_id, uuid)
-                        if addr in addr_not_found_list:
-                            addr_not_found_list.remove(addr)
-                        tag_counter += 1
-            asset_counter += 1      
-        logging.info('Tagged ' + str(tag_counter) + ' of ' + str(asset_counter) + ' assets in ' + org_name + ' (' + org_id + ').')
+    not_tagged = retry_failed_batches(bearer_token, retry_queue)
+    if not_tagged:
+        logging.error(str(len(not_tagged)) + ' assets could not be tagged.')
+        logging.error(not_tagged)
   
     # Write list of addresses that were not found
+    addr_not_found_list = addr_index.not_found()
     if addr_not_found_list:
         logging.warning('One or more addresses were not found in inventory. ')
         logging.warning(addr_not_found_list)
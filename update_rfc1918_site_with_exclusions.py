@@ -9,16 +9,25 @@
     * It is assumed that the RFC 1918 scan task will be configured to to pull exclusions from the site exclusions list.
     * The site can be part of an existing org or a new org created specifically for this purpose.
     * This script does not account for any IPs or subnets that are defined within a specific task configuration.
+    * Known networks are merged into the smallest list of CIDRs before they are written, so overlapping sites and
+      subnets do not produce duplicate or redundant exclusions. Entries that are not IPs, CIDRs or ranges (e.g.
+      hostnames) are kept as they are.
+    * The current scope and exclusions of the RFC 1918 scan site are read first and compared with the new ones by
+      the addresses they cover. The site is only updated when they differ, and the added and removed addresses
+      are printed, so the script can run from cron as often as needed.
 
     Set ORG_IDS to the list of org UUIDs that you want to pull registered subnets from. 
     Set RFC1918_ORG_ID to the org UUID that contains the RFC 1918 scan.
     Set RFC1918_SITE_ID to the site UUID of the site that the RFC 1918 scan is configured in.
+    Set RFC1918_MODE to 'target' to write RFC 1918 minus the known networks as the scope of the site instead of
+    writing the known networks as exclusions; the RFC 1918 scan task should then use the site scope.
 '''
 
-import requests
+import runzero_client
 import os
 import json
 from datetime import datetime
+from ip_ranges import aggregate_cidrs, diff_scopes, merge_ranges, normalize_scope, parse_range, scope_digest, subtract_ranges
 
 # These can be removed if you are hard coding the org id and export token
 from dotenv import load_dotenv
@@ -39,19 +48,26 @@ ORG_IDS = [
 RFC1918_ORG_ID = 'XXXXXXXX-XXXX-XXXX-XXXX-XXXXXXXXXXXX'
 RFC1918_SITE_ID = 'XXXXXXXX-XXXX-XXXX-XXXX-XXXXXXXXXXXX'
 
+# 'exclude' writes the known networks to the site exclusions; the scan targets all of RFC 1918
+# 'target' writes RFC 1918 minus the known networks to the site scope; only unknown space is scanned
+RFC1918_MODE = 'exclude'
+
+# lines printed for each kind of change before the rest are summarized
+DIFF_PRINT_LIMIT = 50
+
+RFC1918_RANGES = [
+    '10.0.0.0/8',
+    '172.16.0.0/12',
+    '192.168.0.0/16'
+]
+
 # Authentication with client ID and secret and obtain bearer token
 def get_token():
-    url = f'{RUNZERO_BASE_URL}/account/api/token'
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = {"grant_type": "client_credentials"}
-    
-    response = requests.post(url, data=data, headers=headers, verify=True, auth=(RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET))
-    
-    if response.status_code != 200:
-        print("Failed to obtain token from OAuth server.")
+    try:
+        return runzero_client.get_token(RUNZERO_BASE_URL, RUNZERO_CLIENT_ID, RUNZERO_CLIENT_SECRET)
+    except runzero_client.TokenError as e:
+        print(e)
         exit(1)
-    
-    return response.json()['access_token']
 
 # Get all sites for the specified organization
 def get_sites(token, org_id):
@@ -61,7 +77,7 @@ def get_sites(token, org_id):
         "Authorization": "Bearer " + token
     }
     
-    response = requests.get(url, headers=headers)
+    response = runzero_client.get(url, headers=headers)
     
     if response.status_code != 200:
         print("Failed to retrieve site data for org {org_id}.")
@@ -69,24 +85,67 @@ def get_sites(token, org_id):
     
     return json.loads(response.text)
 
-def update_exclusions(token, exclusions):
+# Normalize scope lines and subnets into a ScopeTable; a line may hold several entries separated by commas or
+# spaces. Hostnames and entries that cannot be parsed are returned separately without duplicates, and the
+# entries that cannot be parsed are reported.
+def parse_known_networks(entries):
+    table = normalize_scope(entries)
+    for _, text in table.invalid:
+        print(f"Could not parse scope entry {text}; it is passed on unchanged.")
+    unparsed = dict.fromkeys(text for _, text in table.hostnames + table.invalid)
+    return table, list(unparsed)
+
+# RFC 1918 space that is not covered by the known networks, as the smallest list of CIDRs
+def rfc1918_targets(known):
+    rfc1918 = merge_ranges(parse_range(r)[1:] for r in RFC1918_RANGES)
+    return aggregate_cidrs((4, start, end) for start, end in subtract_ranges(rfc1918, known.merged(4)))
+
+# Get the RFC 1918 scan site
+def get_site(token):
     url = f'{RUNZERO_BASE_URL}/org/sites/{RFC1918_SITE_ID}?_oid={RFC1918_ORG_ID}'
     headers = {
         "Content-Type": "application/json",
         "Authorization": "Bearer " + token
     }
-    data = {
-        "excludes": ", ".join(exclusions)
+    
+    response = runzero_client.get(url, headers=headers)
+    
+    if response.status_code != 200:
+        print("Failed to retrieve RFC 1918 scan site.")
+        exit(1)
+    
+    return json.loads(response.text)
+
+def update_site(token, data):
+    url = f'{RUNZERO_BASE_URL}/org/sites/{RFC1918_SITE_ID}?_oid={RFC1918_ORG_ID}'
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": "Bearer " + token
     }
     
-    response = requests.patch(url, headers=headers, json=data)
+    response = runzero_client.patch(url, headers=headers, json=data)
     
     if response.status_code != 200:
-        print("Failed to update exclusions for RFC 1918 scan site.")
+        print("Failed to update RFC 1918 scan site.")
         exit(1)
     
     return
 
+# Site fields managed by this script and the text they should hold
+# In target mode the scope is set to the targets and entries that could not be parsed stay in the exclusions
+def desired_site_fields(known, unparsed):
+    if RFC1918_MODE == 'target':
+        return {"scope": "\n".join(rfc1918_targets(known)), "excludes": ", ".join(unparsed)}
+    return {"excludes": ", ".join(known.cidrs() + unparsed)}
+
+def print_diff(field, diff):
+    print(f"Changes to {field}:")
+    for key, sign in (('added', '+'), ('removed', '-'), ('added_entries', '+'), ('removed_entries', '-')):
+        for entry in diff[key][:DIFF_PRINT_LIMIT]:
+            print(f"  {sign} {entry}")
+        if len(diff[key]) > DIFF_PRINT_LIMIT:
+            print(f"  {sign} ... and {len(diff[key]) - DIFF_PRINT_LIMIT} more")
+
 def main():
     token = get_token()
     registered_subnets = []
@@ -97,6 +156,10 @@ def main():
         
         for s in sites:
 
+            # The RFC 1918 scan site may be part of one of these orgs; its own scope is not a known network
+            if s.get('id') == RFC1918_SITE_ID:
+                continue
+
             # Parse default scan scope
             scope = s.get('scope', '')
             addr_array = scope.splitlines()
@@ -109,8 +172,27 @@ def main():
             for addr in addr_array:
                 registered_subnets.append(addr)
     
-    update_exclusions(token, registered_subnets)
-    print("Successfully updated exclusions for RFC 1918 scan site.")
+    known, unparsed = parse_known_networks(registered_subnets)
+
+    # Compare each managed field with what the site holds now and only send the fields that changed
+    site = get_site(token)
+    changes = {}
+    for field, value in desired_site_fields(known, unparsed).items():
+        current = normalize_scope([site.get(field) or ''])
+        desired = normalize_scope([value])
+        digest = scope_digest(desired)
+        if scope_digest(current) == digest:
+            print(f"RFC 1918 scan site {field} unchanged (digest {digest[:12]}).")
+            continue
+        print_diff(field, diff_scopes(current, desired))
+        changes[field] = value
+
+    if not changes:
+        print("RFC 1918 scan site is up to date; no update needed.")
+        return
+
+    update_site(token, changes)
+    print(f"Successfully updated {' and '.join(changes)} for RFC 1918 scan site.")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file